@@ -10,6 +10,9 @@ class IlifuConfig(AppConfig):
     name = 'ilifu'
 
     def ready(self):
+        # connects the signals that invalidate the cached <option> lists
+        from . import options  # noqa: F401
+
         try:
             from helpdesk.models import FollowUp
             from .utils import custom_followup_display
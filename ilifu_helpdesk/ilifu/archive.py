@@ -0,0 +1,185 @@
+"""
+Moves long closed tickets out of helpdesk's tables.
+
+Most tickets were closed years ago, yet every dashboard, list and search
+query scans them. Tickets that have been closed or resolved, and left
+unchanged, for ``ILIFU_ARCHIVE_AFTER_DAYS`` are serialized into an
+:class:`ilifu.models.ArchivedTicket` (with their CCs, custom field values,
+dependencies and checklists) and one :class:`ilifu.models.ArchivedFollowUp`
+per follow-up (with its ticket changes and attachment metadata), then
+deleted from the helpdesk tables. Attachment files stay where they are.
+
+Archived tickets keep their id: the ticket URL shows them read only (see
+ilifu.views.view_ticket) and :func:`restore_ticket` puts them back as they
+were. The ``archive_tickets`` and ``restore_archived_tickets`` commands run
+both.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from helpdesk.models import Ticket
+
+from .models import ArchivedFollowUp, ArchivedTicket
+
+logger = logging.getLogger(__name__)
+
+# relations of a ticket stored in ArchivedTicket.data, parents before children
+TICKET_RELATIONS = ('ticketcc_set', 'ticketcustomfieldvalue_set', 'ticketdependency', 'depends_on', 'checklists')
+
+
+def get_archive_age():
+    return timedelta(days=getattr(settings, 'ILIFU_ARCHIVE_AFTER_DAYS', 2 * 365))
+
+
+def get_chunk_size():
+    return getattr(settings, 'ILIFU_ARCHIVE_CHUNK_SIZE', 200)
+
+
+def _archivable(tickets, cutoff):
+    return tickets.filter(
+        status__in=(Ticket.CLOSED_STATUS, Ticket.RESOLVED_STATUS),
+        modified__lt=cutoff,
+        merged_tickets__isnull=True,
+        depends_on__isnull=True,
+    )
+
+
+def archivable_tickets(age=None):
+    """
+    Tickets closed or resolved and unchanged for longer than ``age``.
+
+    Tickets that others were merged into, or that others depend on, are left
+    until those have been archived, since deleting them would delete the
+    merged tickets or the dependencies.
+    """
+    return _archivable(Ticket.objects.all(), timezone.now() - (age if age is not None else get_archive_age()))
+
+
+def _serialize(objects):
+    return serializers.serialize('python', objects)
+
+
+def _archive_chunk(ticket_ids, cutoff):
+    # check again under the lock: a ticket may have been reopened, updated or
+    # merged into since the ids were collected
+    tickets = list(_archivable(Ticket.objects.select_for_update(of=('self',)).filter(id__in=ticket_ids), cutoff))
+    prefetch_related_objects(
+        tickets,
+        *TICKET_RELATIONS,
+        'checklists__tasks',
+        'followup_set__ticketchange_set',
+        'followup_set__followupattachment_set',
+    )
+
+    archived_tickets, archived_followups = [], []
+    for ticket in tickets:
+        records = [ticket]
+        for relation in TICKET_RELATIONS:
+            records.extend(getattr(ticket, relation).all())
+        for checklist in ticket.checklists.all():
+            records.extend(checklist.tasks.all())
+        archived_tickets.append(ArchivedTicket(
+            id=ticket.id,
+            queue_id=ticket.queue_id,
+            title=ticket.title,
+            submitter_email=ticket.submitter_email,
+            status=ticket.status,
+            created=ticket.created,
+            modified=ticket.modified,
+            data=_serialize(records),
+        ))
+        archived_followups.extend(
+            ArchivedFollowUp(
+                id=followup.id,
+                ticket_id=ticket.id,
+                date=followup.date,
+                data=_serialize([
+                    followup, *followup.ticketchange_set.all(), *followup.followupattachment_set.all()
+                ]),
+            )
+            for followup in ticket.followup_set.all()
+        )
+
+    ArchivedTicket.objects.bulk_create(archived_tickets)
+    ArchivedFollowUp.objects.bulk_create(archived_followups)
+    Ticket.objects.filter(id__in=[ticket.id for ticket in tickets]).delete()
+    return len(tickets)
+
+
+def archive_tickets(age=None, progress=None):
+    """
+    Archive the tickets closed or resolved and unchanged for longer than
+    ``age`` (see :func:`archivable_tickets`) a chunk at a time, each chunk in
+    its own transaction. ``progress``, if given, is called with the number
+    archived so far after every chunk. Returns the number of tickets archived.
+    """
+    cutoff = timezone.now() - (age if age is not None else get_archive_age())
+    ticket_ids = list(_archivable(Ticket.objects.all(), cutoff).values_list('id', flat=True))
+    chunk_size = get_chunk_size()
+    archived = 0
+    for start in range(0, len(ticket_ids), chunk_size):
+        with transaction.atomic():
+            archived += _archive_chunk(ticket_ids[start:start + chunk_size], cutoff)
+        if progress is not None:
+            progress(archived)
+    return archived
+
+
+def _deserialize(data):
+    return [deserialized.object for deserialized in serializers.deserialize('python', data)]
+
+
+def _restorable(obj):
+    """
+    Null the foreign keys of ``obj`` whose targets have been deleted since it
+    was archived, e.g. a former staff member. Returns False if one of them
+    cannot be null, i.e. ``obj`` has nothing left to belong to.
+    """
+    for field in obj._meta.concrete_fields:
+        value = getattr(obj, field.attname)
+        if not field.many_to_one or value is None:
+            continue
+        if field.related_model._default_manager.filter(pk=value).exists():
+            continue
+        if not field.null:
+            logger.warning(f'Not restoring {obj._meta.label} {obj.pk}: {field.name} {value} no longer exists')
+            return False
+        setattr(obj, field.attname, None)
+    return True
+
+
+@transaction.atomic
+def restore_ticket(archived):
+    """Put an :class:`ArchivedTicket` back into helpdesk's tables and drop it from the archive."""
+    records = _deserialize(archived.data)
+    for followup in archived.followups.all():
+        records.extend(_deserialize(followup.data))
+    # the ticket, then its relations and follow-ups, each before their children
+    for obj in records:
+        if _restorable(obj):
+            obj.save_base(raw=True)
+    archived.delete()
+    return records[0]
+
+
+def load_archived_ticket(archived):
+    """
+    The unsaved Ticket and FollowUps of an :class:`ArchivedTicket`, for
+    showing it read only. Each follow-up carries its ``archived_changes`` and
+    ``archived_attachments``.
+    """
+    ticket = _deserialize(archived.data)[0]
+    followups = []
+    for archived_followup in archived.followups.all():
+        followup, *related = _deserialize(archived_followup.data)
+        followup.archived_changes = [obj for obj in related if obj._meta.model_name == 'ticketchange']
+        followup.archived_attachments = [obj for obj in related if obj._meta.model_name == 'followupattachment']
+        followups.append(followup)
+    prefetch_related_objects([ticket], 'queue', 'assigned_to')
+    prefetch_related_objects(followups, 'user')
+    return ticket, followups
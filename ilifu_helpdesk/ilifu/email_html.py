@@ -0,0 +1,183 @@
+"""
+Shrinks the HTML bodies of incoming emails before they are stored.
+
+custom_followup_display inlines email_html_body.html into the ticket page,
+so every base64 ``data:`` image in an email, and every repeat of the same
+signature logo across a thread, is sent again on every view of the ticket.
+Here embedded images, both ``data:`` URIs and ``cid:`` references to the
+message's related MIME parts, are stored once per distinct content as an
+:class:`ilifu.models.InlineImage` and referenced by URL, which the browser
+caches. Comments, scripts, Office XML islands and ``<style>`` blocks or
+``style`` attributes larger than ``ILIFU_EMAIL_MAX_STYLE_SIZE`` are dropped.
+
+The ``externalize_email_images`` command applies the same transform to the
+HTML bodies already stored.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import mimetypes
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from helpdesk.email import HTML_EMAIL_ATTACHMENT_FILENAME
+
+from .models import InlineImage
+
+logger = logging.getLogger(__name__)
+
+# Image types that are safe to serve from the helpdesk's own origin; SVG can
+# carry script, so SVG data URIs are left inline
+IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp')
+
+DATA_IMAGE_RE = re.compile(
+    r'(?<=["\'(])data:(?P<mime_type>image/[a-z0-9.+-]+);base64,(?P<data>[a-z0-9+/=\s]+?)(?=["\')])',
+    re.IGNORECASE,
+)
+CID_RE = re.compile(r'(?<=["\'(])cid:(?P<cid>[^"\'\s)>]+)', re.IGNORECASE)
+# Comments, including Outlook's conditional comments; the content of the
+# <!--[if !mso]><!--> ... <!--<![endif]--> form is kept. <style> and <script>
+# blocks are matched too so that the comments inside them, such as the
+# <style><!-- ... --></style> wrapping every Outlook stylesheet, are left alone.
+COMMENT_RE = re.compile(
+    r'(?P<block><(?P<tag>style|script)\b[^>]*>.*?</(?P=tag)\s*>)|<!--.*?-->',
+    re.DOTALL | re.IGNORECASE,
+)
+DEAD_MARKUP_RES = (
+    re.compile(r'<script\b.*?</script\s*>', re.DOTALL | re.IGNORECASE),
+    re.compile(r'<xml\b.*?</xml\s*>', re.DOTALL | re.IGNORECASE),
+    re.compile(r'</?o:p\s*>', re.IGNORECASE),
+)
+STYLE_BLOCK_RE = re.compile(r'<style\b[^>]*>.*?</style\s*>', re.DOTALL | re.IGNORECASE)
+STYLE_ATTRIBUTE_RE = re.compile(r'\sstyle\s*=\s*(?:"[^"]*"|\'[^\']*\')', re.IGNORECASE)
+
+
+def get_max_style_size():
+    return getattr(settings, 'ILIFU_EMAIL_MAX_STYLE_SIZE', 16 * 1024)
+
+
+def store_inline_image(data, mime_type):
+    """The :class:`InlineImage` holding ``data``, stored first if it is new."""
+    digest = hashlib.sha256(data).hexdigest()
+    image = InlineImage.objects.filter(digest=digest).first()
+    if image is not None:
+        return image
+
+    image = InlineImage(digest=digest, mime_type=mime_type, size=len(data))
+    extension = mimetypes.guess_extension(mime_type) or ''
+    image.file.save(f'{digest}{extension}', ContentFile(data), save=False)
+    try:
+        with transaction.atomic():
+            image.save()
+    except IntegrityError:
+        # stored by a concurrent ingest in the meantime
+        image.file.delete(save=False)
+        image = InlineImage.objects.get(digest=digest)
+    return image
+
+
+def get_cid_images(message):
+    """
+    The images among the MIME parts of ``message`` that HTML bodies can refer
+    to, as ``{content id: (data, mime type)}``.
+    """
+    images = {}
+    for part in message.walk():
+        content_id = part.get('Content-ID')
+        if not content_id or part.get_content_type() not in IMAGE_TYPES:
+            continue
+        data = part.get_payload(decode=True)
+        if data:
+            images[content_id.strip().strip('<>')] = (data, part.get_content_type())
+    return images
+
+
+def _strip_oversized_styles(html):
+    max_size = get_max_style_size()
+
+    def strip(match):
+        return '' if len(match.group(0)) > max_size else match.group(0)
+
+    html = STYLE_BLOCK_RE.sub(strip, html)
+    return STYLE_ATTRIBUTE_RE.sub(strip, html)
+
+
+def _inline_image_url(data, mime_type):
+    return store_inline_image(data, mime_type).get_absolute_url()
+
+
+def compact_email_html(html, cid_images=None, image_url=_inline_image_url):
+    """
+    ``html`` with its embedded images replaced by :class:`InlineImage` URLs
+    and its dead markup and oversized styles removed.
+
+    ``cid_images`` maps content ids to ``(data, mime type)``, see
+    :func:`get_cid_images`. ``image_url(data, mime_type)`` stores an image
+    and returns its URL. Returns the new HTML and the set of content ids that
+    were replaced.
+    """
+    cid_images = cid_images or {}
+    replaced_cids = set()
+
+    html = COMMENT_RE.sub(lambda match: match.group('block') or '', html)
+    for pattern in DEAD_MARKUP_RES:
+        html = pattern.sub('', html)
+
+    def replace_data(match):
+        mime_type = match.group('mime_type').lower()
+        if mime_type not in IMAGE_TYPES:
+            return match.group(0)
+        try:
+            data = base64.b64decode(re.sub(r'\s', '', match.group('data')), validate=True)
+        except (binascii.Error, ValueError):
+            logger.warning('Leaving an undecodable data: image in an email body as it is')
+            return match.group(0)
+        return image_url(data, mime_type)
+
+    def replace_cid(match):
+        cid = match.group('cid')
+        if cid not in cid_images:
+            return match.group(0)
+        replaced_cids.add(cid)
+        return image_url(*cid_images[cid])
+
+    html = DATA_IMAGE_RE.sub(replace_data, html)
+    html = CID_RE.sub(replace_cid, html)
+    # once the images are out, so that a style is not dropped for its image
+    html = _strip_oversized_styles(html)
+    return html, replaced_cids
+
+
+def compact_email_files(message, files):
+    """
+    The attachments extracted from ``message`` with the HTML body compacted
+    by :func:`compact_email_html`. The image parts that the body now refers
+    to by URL are dropped; they are stored as :class:`InlineImage` instead.
+    """
+    for i, attached in enumerate(files):
+        if attached.name == str(HTML_EMAIL_ATTACHMENT_FILENAME):
+            break
+    else:
+        return files
+
+    cid_images = get_cid_images(message)
+    attached.seek(0)
+    html, replaced_cids = compact_email_html(
+        attached.read().decode('utf-8', errors='replace'), cid_images
+    )
+    files = list(files)
+    files[i] = SimpleUploadedFile(attached.name, html.encode('utf-8'), 'text/html')
+
+    replaced_digests = {hashlib.sha256(cid_images[cid][0]).hexdigest() for cid in replaced_cids}
+
+    def is_replaced(attached):
+        attached.seek(0)
+        digest = hashlib.sha256(attached.read()).hexdigest()
+        attached.seek(0)
+        return digest in replaced_digests
+
+    return [attached for attached in files if not is_replaced(attached)] if replaced_digests else files
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ilifu.archive import archivable_tickets, archive_tickets, get_archive_age
+
+
+class Command(BaseCommand):
+    help = (
+        'Move tickets that have been closed or resolved for longer than ILIFU_ARCHIVE_AFTER_DAYS '
+        '(or --days) out of the helpdesk tables into the archive. Suitable for cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive tickets unchanged for this many days instead')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many tickets would be archived')
+
+    def handle(self, *args, **options):
+        age = timedelta(days=options['days']) if options['days'] is not None else get_archive_age()
+        if options['dry_run']:
+            self.stdout.write(f'Would archive {archivable_tickets(age).count()} tickets')
+            return
+
+        def progress(archived):
+            self.stdout.write(f'Archived {archived} tickets')
+
+        archived = archive_tickets(age, progress=progress if options['verbosity'] > 1 else None)
+        self.stdout.write(f'Archived {archived} tickets unchanged for {age.days} days')
@@ -0,0 +1,61 @@
+import os
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from helpdesk.email import HTML_EMAIL_ATTACHMENT_FILENAME
+from helpdesk.models import FollowUpAttachment
+
+from ilifu.email_html import compact_email_html
+
+
+class Command(BaseCommand):
+    help = (
+        'Externalize the embedded data: images of the HTML email bodies already stored and strip '
+        'their dead markup and oversized styles, as is done for incoming email. cid: images cannot '
+        'be recovered for stored bodies since the messages holding them are gone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Report the savings without storing or changing anything'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        compact_kwargs = {}
+        if dry_run:
+            # a URL as long as the real ones, so that the savings add up
+            placeholder_url = reverse('inline_image', args=['0' * 64])
+            compact_kwargs['image_url'] = lambda data, mime_type: placeholder_url
+
+        count, saved = 0, 0
+        attachments = FollowUpAttachment.objects.filter(filename__iexact=HTML_EMAIL_ATTACHMENT_FILENAME)
+        for attachment in attachments.iterator():
+            try:
+                with attachment.file.open('rb') as f:
+                    html = f.read().decode('utf-8', errors='replace')
+            except (IOError, ValueError) as e:
+                self.stderr.write(f'Skipping attachment {attachment.id}: {e}')
+                continue
+
+            compacted, _ = compact_email_html(html, **compact_kwargs)
+            data = compacted.encode('utf-8')
+            if len(data) >= attachment.size:
+                continue
+
+            count += 1
+            saved += attachment.size - len(data)
+            if dry_run:
+                continue
+
+            old_name = attachment.file.name
+            attachment.file.save(os.path.basename(old_name), ContentFile(data), save=False)
+            attachment.size = len(data)
+            attachment.save(update_fields=['file', 'size'])
+            # only once nothing refers to it any more
+            attachment.file.storage.delete(old_name)
+
+        self.stdout.write(
+            f'{"Would compact" if dry_run else "Compacted"} {count} HTML email bodies, saving {saved} bytes'
+        )
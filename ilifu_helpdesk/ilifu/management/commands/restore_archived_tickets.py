@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ilifu.archive import restore_ticket
+from ilifu.models import ArchivedTicket
+
+
+class Command(BaseCommand):
+    help = 'Move archived tickets back into the helpdesk tables, with the ids they had.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ticket_ids', nargs='+', type=int, metavar='ticket_id')
+
+    def handle(self, *args, **options):
+        archived_tickets = ArchivedTicket.objects.filter(id__in=options['ticket_ids'])
+        missing = set(options['ticket_ids']) - {archived.id for archived in archived_tickets}
+        if missing:
+            raise CommandError(f'Not archived: {", ".join(str(ticket_id) for ticket_id in sorted(missing))}')
+        for archived in archived_tickets:
+            ticket = restore_ticket(archived)
+            self.stdout.write(f'Restored ticket {ticket.id}')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ilifu.mass_update import requeue_stale_jobs, run_job
+from ilifu.models import MassUpdateJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Run mass update jobs that are still queued, or were left running, because the web worker '
+        'that accepted them was restarted before it could start or finish them. Suitable for cron.'
+    )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Resuming {requeued} mass update jobs left running')
+        for job_id in MassUpdateJob.objects.filter(status=MassUpdateJob.QUEUED).values_list('id', flat=True):
+            self.stdout.write(f'Running mass update job {job_id}')
+            run_job(job_id)
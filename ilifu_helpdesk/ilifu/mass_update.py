@@ -0,0 +1,292 @@
+"""
+Bulk execution of the ticket list's "With Selected Tickets" actions.
+
+helpdesk's own mass_update saves every ticket and follow-up individually
+(each FollowUp.save() saves its ticket once more) and sends the close
+emails inline, which times out for a few thousand tickets. Here the selected
+tickets are processed in chunks of ``ILIFU_MASS_UPDATE_CHUNK_SIZE``: each
+chunk is one transaction that updates the tickets with ``bulk_update`` and
+records the follow-ups and ticket changes with ``bulk_create``. Emails for
+``close_public`` are sent per chunk once it has been committed.
+
+Selections of ``ILIFU_MASS_UPDATE_BACKGROUND_THRESHOLD`` tickets or more are
+stored as a :class:`ilifu.models.MassUpdateJob` and run on a background
+thread, which records its progress on the job. The ``run_mass_update_jobs``
+command picks up jobs whose thread never started or died part way through.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from helpdesk import settings as helpdesk_settings
+from helpdesk.lib import queue_template_context, safe_template_context
+from helpdesk.models import FollowUp, KBItem, Ticket, TicketChange
+from helpdesk.user import HelpdeskUser
+
+from .models import MassUpdateJob
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+def get_chunk_size():
+    return getattr(settings, 'ILIFU_MASS_UPDATE_CHUNK_SIZE', 500)
+
+
+def get_background_threshold():
+    return getattr(settings, 'ILIFU_MASS_UPDATE_BACKGROUND_THRESHOLD', 200)
+
+
+def get_stale_age():
+    return timedelta(seconds=getattr(settings, 'ILIFU_MASS_UPDATE_STALE_SECONDS', 15 * 60))
+
+
+# the actions that take no target
+PLAIN_ACTIONS = ('unassign', 'close', 'close_public', 'delete')
+
+
+def parse_action(action, user):
+    """
+    Turn the posted action value into ``(action, target)`` the same way
+    helpdesk's mass_update does, e.g. ``assign_12`` into ``('assign', <User 12>)``.
+
+    Raises ValueError for an unknown action or a target that does not exist.
+    """
+    try:
+        if action == 'take':
+            return 'assign', user
+        if action.startswith('assign_'):
+            return 'assign', User.objects.get(id=action.split('_')[1])
+        if action == 'kbitem_none':
+            return 'set_kbitem', None
+        if action.startswith('kbitem_'):
+            return 'set_kbitem', KBItem.objects.get(id=action.split('_')[1])
+    except (User.DoesNotExist, KBItem.DoesNotExist) as e:
+        raise ValueError(f'Unknown mass update target: {action}') from e
+    if action in PLAIN_ACTIONS:
+        return action, None
+    raise ValueError(f'Unknown mass update action: {action}')
+
+
+def _apply_action(ticket, action, target):
+    """
+    Change ``ticket`` in memory for ``action``.
+
+    Returns ``(followup_kwargs, changes)`` describing the follow-up to record,
+    or None if the action leaves this ticket as it is.
+    """
+    if action == 'assign':
+        if ticket.assigned_to_id == target.id:
+            return None
+        changes = [(_('Owner'), ticket.assigned_to, target)]
+        ticket.assigned_to = target
+        return {
+            'title': _('Assigned to %(username)s in bulk update') % {'username': target.get_username()},
+            'public': True,
+        }, changes
+    if action == 'unassign':
+        if ticket.assigned_to_id is None:
+            return None
+        changes = [(_('Owner'), ticket.assigned_to, None)]
+        ticket.assigned_to = None
+        return {'title': _('Unassigned in bulk update'), 'public': True}, changes
+    if action == 'set_kbitem':
+        changes = [(_('Knowledge base item'), ticket.kbitem, target)]
+        ticket.kbitem = target
+        return {'title': _('KBItem set in bulk update'), 'public': False}, changes
+    if action in ('close', 'close_public'):
+        if ticket.status == Ticket.CLOSED_STATUS:
+            return None
+        old_status = ticket.get_status_display()
+        ticket.status = Ticket.CLOSED_STATUS
+        changes = [(_('Status'), old_status, ticket.get_status_display())]
+        return {
+            'title': _('Closed in bulk update'),
+            'public': action == 'close_public',
+            'new_status': Ticket.CLOSED_STATUS,
+        }, changes
+    raise ValueError(f'Unknown mass update action: {action}')
+
+
+UPDATED_FIELDS = {
+    'assign': ['assigned_to', 'modified'],
+    'unassign': ['assigned_to', 'modified'],
+    'set_kbitem': ['kbitem', 'modified'],
+    'close': ['status', 'modified'],
+    'close_public': ['status', 'modified'],
+}
+
+
+def _update_chunk(tickets, user, action, target):
+    """
+    Apply ``action`` to ``tickets`` with one bulk query per table. Returns the
+    changed tickets.
+
+    With ``FOLLOWUP_TIME_SPENT_AUTO`` on, helpdesk's time spent calculation
+    still queries each ticket's previous follow-ups, one ticket at a time.
+    """
+    now = timezone.now()
+    changed, followups, changes = [], [], []
+    for ticket in tickets:
+        result = _apply_action(ticket, action, target)
+        if result is None:
+            continue
+        followup_kwargs, ticket_changes = result
+        ticket.modified = now
+        followup = FollowUp(ticket=ticket, date=now, user=user, **followup_kwargs)
+        if helpdesk_settings.FOLLOWUP_TIME_SPENT_AUTO:
+            followup.time_spent = followup.time_spent_calculation()
+        changed.append(ticket)
+        followups.append(followup)
+        changes.append(ticket_changes)
+
+    if not changed:
+        return changed
+
+    Ticket.objects.bulk_update(changed, UPDATED_FIELDS[action])
+    FollowUp.objects.bulk_create(followups)
+    TicketChange.objects.bulk_create(
+        TicketChange(followup=followup, field=field, old_value=old_value, new_value=new_value)
+        for followup, ticket_changes in zip(followups, changes)
+        for field, old_value, new_value in ticket_changes
+    )
+    return changed
+
+
+def _send_close_emails(tickets, user):
+    """The emails helpdesk's mass_update sends for ``close_public``, for a committed chunk."""
+    for ticket in tickets:
+        context = safe_template_context(ticket)
+        context.update(
+            resolution=ticket.resolution, queue=queue_template_context(ticket.queue)
+        )
+
+        messages_sent_to = set()
+        if user.email:
+            messages_sent_to.add(user.email)
+
+        roles = {
+            'submitter': ('closed_submitter', context),
+            'ticket_cc': ('closed_cc', context),
+        }
+        if (
+            ticket.assigned_to
+            and hasattr(ticket.assigned_to, 'usersettings_helpdesk')
+            and ticket.assigned_to.usersettings_helpdesk.email_on_ticket_change
+        ):
+            roles['assigned_to'] = ('closed_owner', context)
+
+        ticket.send(roles, dont_send_to=messages_sent_to, fail_silently=True)
+
+
+def run_mass_update(user, ticket_ids, action, progress=None):
+    """
+    Apply the posted ``action`` to the tickets in ``ticket_ids`` that ``user``
+    may access, a chunk at a time.
+
+    ``progress``, if given, is called with the number of tickets processed so
+    far after every chunk. Returns the number of tickets that were changed.
+    """
+    action, target = parse_action(action, user)
+    huser = HelpdeskUser(user)
+    queue_access = {}
+
+    def can_access(ticket):
+        if ticket.queue_id not in queue_access:
+            queue_access[ticket.queue_id] = huser.can_access_queue(ticket.queue)
+        return queue_access[ticket.queue_id]
+
+    ticket_ids = list(ticket_ids)
+    chunk_size = get_chunk_size()
+    changed_count = 0
+    for start in range(0, len(ticket_ids), chunk_size):
+        chunk_ids = ticket_ids[start:start + chunk_size]
+        tickets = Ticket.objects.filter(id__in=chunk_ids).select_related(
+            'queue', 'assigned_to', 'kbitem__category'
+        )
+        if action == 'close_public':
+            tickets = tickets.select_related('assigned_to__usersettings_helpdesk').prefetch_related(
+                'ticketcc_set'
+            )
+
+        with transaction.atomic():
+            tickets = [ticket for ticket in tickets if can_access(ticket)]
+            if action == 'delete':
+                Ticket.objects.filter(id__in=[ticket.id for ticket in tickets]).delete()
+                changed = tickets
+            else:
+                changed = _update_chunk(tickets, user, action, target)
+
+        if action == 'close_public':
+            _send_close_emails(changed, user)
+
+        changed_count += len(changed)
+        if progress is not None:
+            progress(start + len(chunk_ids))
+    return changed_count
+
+
+def run_job(job_id):
+    """
+    Run a queued :class:`MassUpdateJob`, recording its progress as it goes.
+
+    The job is claimed by moving it from queued to running in a single
+    update, so if the background thread and ``run_mass_update_jobs`` both try
+    to run it only one of them does. A job resumed by
+    :func:`requeue_stale_jobs` carries on after the tickets already processed.
+    """
+    claimed = MassUpdateJob.objects.filter(id=job_id, status=MassUpdateJob.QUEUED).update(
+        status=MassUpdateJob.RUNNING, heartbeat=timezone.now()
+    )
+    if not claimed:
+        return
+    job = MassUpdateJob.objects.select_related('user').get(id=job_id)
+
+    def progress(processed):
+        MassUpdateJob.objects.filter(id=job.id).update(
+            processed=job.processed + processed, heartbeat=timezone.now()
+        )
+
+    try:
+        run_mass_update(job.user, job.ticket_ids[job.processed:], job.action, progress=progress)
+    except Exception as e:
+        logger.exception(f'Mass update job {job.id} failed')
+        MassUpdateJob.objects.filter(id=job.id).update(
+            status=MassUpdateJob.FAILED, error=str(e), finished=timezone.now()
+        )
+    else:
+        MassUpdateJob.objects.filter(id=job.id).update(
+            status=MassUpdateJob.DONE, finished=timezone.now()
+        )
+
+
+def requeue_stale_jobs():
+    """
+    Queue running jobs again whose thread has not recorded progress for
+    ``ILIFU_MASS_UPDATE_STALE_SECONDS``, i.e. was killed by a restart.
+    Returns the number of jobs requeued.
+    """
+    return MassUpdateJob.objects.filter(
+        status=MassUpdateJob.RUNNING, heartbeat__lt=timezone.now() - get_stale_age()
+    ).update(status=MassUpdateJob.QUEUED)
+
+
+def _run_job_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # this thread's connections are not closed by any request signal
+        connections.close_all()
+
+
+def start_job(job):
+    """Run ``job`` on a background thread once the current transaction has committed."""
+    transaction.on_commit(
+        lambda: threading.Thread(target=_run_job_in_thread, args=(job.id,), daemon=True).start()
+    )
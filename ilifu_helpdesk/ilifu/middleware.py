@@ -0,0 +1,100 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .routers import get_replica_alias, use_replica
+
+DEFAULT_REPLICA_VIEWS = (
+    'dashboard',
+    'dashboard_stats',
+    'dashboard_recent_activity',
+    'ticket_list',
+    'helpdesk:dashboard',
+    'helpdesk:list',
+    'helpdesk:datatables_ticket_list',
+    'helpdesk:timeline_ticket_list',
+    'helpdesk:report_index',
+    'helpdesk:run_report',
+)
+
+# Present while this browser has to read from the primary.
+PRIMARY_PIN_COOKIE = 'ilifu_use_primary'
+
+# Loaded by TinyMCE itself, under names without a content hash but with its
+# version as query string (see ilifu/js/editor.js).
+TINYMCE_STATIC_PREFIX = 'tinymce/'
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let safe requests to the read-heavy views in ``ILIFU_REPLICA_VIEWS`` read
+    from the replica (see :class:`ilifu.routers.ReplicaRouter`).
+
+    Any request that may have written something (i.e. anything other than
+    GET/HEAD/OPTIONS) pins the browser to the primary for
+    ``ILIFU_REPLICA_STICKY_SECONDS``, so that users always see their own
+    changes, e.g. the ticket list straight after a mass update, even while
+    the replica is catching up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = use_replica.set(self.can_use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.pin_after_write(request, response)
+
+    async def __acall__(self, request):
+        token = use_replica.set(self.can_use_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.pin_after_write(request, response)
+
+    def can_use_replica(self, request):
+        if get_replica_alias() is None or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return False
+        if PRIMARY_PIN_COOKIE in request.COOKIES:
+            return False
+        try:
+            view_name = resolve(request.path_info).view_name
+        except Resolver404:
+            return False
+        return view_name in getattr(settings, 'ILIFU_REPLICA_VIEWS', DEFAULT_REPLICA_VIEWS)
+
+    def pin_after_write(self, request, response):
+        if get_replica_alias() is not None and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            sticky_seconds = getattr(settings, 'ILIFU_REPLICA_STICKY_SECONDS', 15)
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE,
+                '1',
+                max_age=sticky_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, serving the collected static files with their precompressed
+    gzip/brotli variants. Files with a content hash in their name are cached
+    for good; so are TinyMCE's plugins, skins and themes, which the editor
+    requests by plain name but with its version appended.
+    """
+    def immutable_file_test(self, path, url):
+        if url.startswith(self.static_prefix + TINYMCE_STATIC_PREFIX):
+            return True
+        return super().immutable_file_test(path, url)
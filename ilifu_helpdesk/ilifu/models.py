@@ -1,7 +1,9 @@
 from logging import getLogger
 
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.urls import reverse
 
 logger = getLogger()
 
@@ -31,3 +33,91 @@ class Company(models.Model):
     class Meta:
         ordering = ['name']
         verbose_name_plural = 'Companies'
+
+
+class MassUpdateJob(models.Model):
+    """A "With Selected Tickets" action too large to run within the request (see ilifu.mass_update)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    action = models.CharField(max_length=64, help_text='The action as posted by the ticket list, e.g. assign_12')
+    ticket_ids = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    heartbeat = models.DateTimeField(
+        blank=True, null=True, help_text='Last sign of life of the thread running the job'
+    )
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.action} on {self.total} tickets ({self.status})'
+
+    class Meta:
+        ordering = ['-created']
+
+
+class InlineImage(models.Model):
+    """
+    An image that was embedded in an HTML email body, stored once per distinct
+    content and served from its own URL (see ilifu.email_html).
+    """
+    digest = models.CharField(max_length=64, unique=True, help_text='SHA-256 of the image data')
+    file = models.FileField(upload_to='inline_images', max_length=255)
+    mime_type = models.CharField(max_length=64)
+    size = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.digest} ({self.mime_type})'
+
+    def get_absolute_url(self):
+        return reverse('inline_image', args=[self.digest])
+
+
+class ArchivedTicket(models.Model):
+    """
+    A closed ticket moved out of helpdesk's tables (see ilifu.archive). The
+    columns are what a lookup needs; ``data`` holds the serialized ticket and
+    its CCs, custom field values, dependencies and checklists for a restore.
+    """
+    id = models.PositiveIntegerField(primary_key=True, help_text='The id the ticket had, and will have on restore')
+    queue = models.ForeignKey('helpdesk.Queue', on_delete=models.CASCADE)
+    title = models.CharField(max_length=200)
+    submitter_email = models.EmailField(blank=True, null=True, db_index=True)
+    status = models.IntegerField()
+    created = models.DateTimeField()
+    modified = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        return f'{self.queue_id}-{self.id} {self.title} (archived)'
+
+    def get_absolute_url(self):
+        return reverse('helpdesk:view', args=[self.id])
+
+    class Meta:
+        ordering = ['-modified']
+
+
+class ArchivedFollowUp(models.Model):
+    """A follow-up of an :class:`ArchivedTicket`, serialized with its ticket changes and attachment metadata"""
+    id = models.PositiveIntegerField(primary_key=True)
+    ticket = models.ForeignKey(ArchivedTicket, on_delete=models.CASCADE, related_name='followups')
+    date = models.DateTimeField()
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ['date']
@@ -0,0 +1,122 @@
+"""
+Cached ``<option>`` lists for the user and knowledge base item selects.
+
+The ticket page lists every possible owner and the ticket list every staff
+user and KB item, which with thousands of OIDC-provisioned users means a
+large query and a lot of template rendering on every view. The options are
+rendered once, cached as HTML and invalidated whenever a user, KB item or KB
+category is saved or deleted. Selecting the current value is a string
+substitution on the cached fragment, so a page costs one cache lookup per
+select. The ``ilifu_options`` template tags put them in the templates.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+from helpdesk import settings as helpdesk_settings
+from helpdesk.models import KBCategory, KBItem
+
+User = get_user_model()
+
+OWNER_OPTIONS_KEY = 'ilifu:options:owners'
+STAFF_OPTIONS_KEY = 'ilifu:options:staff'
+KBITEM_OPTIONS_KEY = 'ilifu:options:kbitems'
+USER_KEYS = (OWNER_OPTIONS_KEY, STAFF_OPTIONS_KEY)
+
+
+def get_active_users():
+    """The possible ticket owners, as helpdesk's get_active_users() selects them."""
+    users = User.objects.filter(is_active=True)
+    if helpdesk_settings.HELPDESK_STAFF_ONLY_TICKET_OWNERS:
+        users = users.filter(is_staff=True)
+    return users.order_by(User.USERNAME_FIELD)
+
+
+def _cached(key, build):
+    html = cache.get(key)
+    if html is None:
+        html = build()
+        cache.set(key, html, getattr(settings, 'ILIFU_OPTIONS_CACHE_TIMEOUT', 60 * 60))
+    return html
+
+
+def _select(html, values):
+    """Mark the options with the given values as selected in a cached fragment."""
+    for value in values:
+        html = html.replace(f"<option value='{value}'>", f"<option value='{value}' selected>", 1)
+    return mark_safe(html)
+
+
+def owner_options(selected=None):
+    """Options for the owner select of the ticket page, values are user ids."""
+    html = _cached(OWNER_OPTIONS_KEY, lambda: format_html_join(
+        '', "<option value='{}'>{}</option>",
+        ((u.id, str(u)) for u in get_active_users()),
+    ))
+    return _select(html, [selected] if selected else [])
+
+
+def _staff_rows():
+    # the users the ticket list offers, as helpdesk's ticket_list selects them
+    return User.objects.filter(is_active=True, is_staff=True).order_by(User.USERNAME_FIELD)
+
+
+def staff_options(selected=(), prefix=''):
+    """
+    Options for the staff users of the ticket list, values are user ids
+    with ``prefix`` prepended (``assign_`` for the mass update select).
+    """
+    html = _cached(STAFF_OPTIONS_KEY, lambda: format_html_join(
+        '', "<option value='{}'>{}</option>",
+        ((u.id, u.get_username()) for u in _staff_rows()),
+    ))
+    if prefix:
+        html = html.replace("<option value='", f"<option value='{prefix}")
+    return _select(html, [f'{prefix}{value}' for value in selected])
+
+
+def kbitem_options(selected=(), prefix=''):
+    """Options for the KB items, labelled with their category, values are ``prefix`` + id."""
+    html = _cached(KBITEM_OPTIONS_KEY, lambda: format_html_join(
+        '', "<option value='{}'>{}: {}</option>",
+        ((item.id, item.category.title, item.title)
+         for item in KBItem.objects.select_related('category')),
+    ))
+    if prefix:
+        html = html.replace("<option value='", f"<option value='{prefix}")
+    return _select(html, [f'{prefix}{value}' for value in selected])
+
+
+def search_users(term, limit=20):
+    """Possible owners matching ``term``, for the owner typeahead."""
+    users = get_active_users()
+    for word in term.split():
+        users = users.filter(
+            Q(**{f'{User.USERNAME_FIELD}__icontains': word})
+            | Q(first_name__icontains=word)
+            | Q(last_name__icontains=word)
+            | Q(email__icontains=word)
+        )
+    return users[:limit]
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_options(**kwargs):
+    # update_fields=['last_login'] is saved on every login; it changes no option
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    cache.delete_many(USER_KEYS)
+
+
+@receiver(post_save, sender=KBItem)
+@receiver(post_delete, sender=KBItem)
+@receiver(post_save, sender=KBCategory)
+@receiver(post_delete, sender=KBCategory)
+def invalidate_kbitem_options(**kwargs):
+    cache.delete(KBITEM_OPTIONS_KEY)
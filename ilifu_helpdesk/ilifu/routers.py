@@ -0,0 +1,68 @@
+"""
+Database routing for read-heavy views.
+
+The dashboard, the ticket list (and its DataTables and timeline feeds) and
+the reports only read helpdesk data, so when a read replica is configured
+their queries are sent to it and leave the primary to handle ticket updates
+and email ingest. Which requests qualify is decided by
+:class:`ilifu.middleware.ReplicaRoutingMiddleware`; everything else, and
+every write, goes to the primary.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set for the duration of a request that is allowed to read from the replica.
+# A ContextVar rather than a thread local, so that it follows the request into
+# the executor threads used by async views (see ilifu.views.dashboard_async).
+use_replica = ContextVar('ilifu_use_replica', default=False)
+
+
+def get_replica_alias():
+    """The configured replica alias, or None if no replica is available."""
+    alias = getattr(settings, 'ILIFU_REPLICA_DATABASE', 'replica')
+    if alias in settings.DATABASES:
+        return alias
+    return None
+
+
+class ReplicaRouter:
+    """
+    Send reads of helpdesk data to the replica while :data:`use_replica` is
+    set, and everything else to the primary.
+
+    Only the apps in ``ILIFU_REPLICA_APP_LABELS`` are read from the replica;
+    sessions and users are always read from the primary so that replication
+    lag can never log somebody out straight after an OIDC login.
+    """
+
+    def _replica_for(self, model):
+        if not use_replica.get():
+            return None
+        app_labels = getattr(settings, 'ILIFU_REPLICA_APP_LABELS', ('helpdesk', 'ilifu'))
+        if model._meta.app_label not in app_labels:
+            return None
+        # reads inside a transaction must see that transaction's writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return get_replica_alias()
+
+    def db_for_read(self, model, **hints):
+        return self._replica_for(model)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, get_replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        replica = get_replica_alias()
+        if replica is not None and db == replica:
+            return False
+        return None
@@ -0,0 +1,38 @@
+/*
+ * Loads the vendored TinyMCE only on pages with a <textarea data-editor="tinymce">,
+ * and turns those textareas into editors. The script tag including this file
+ * passes the (hashed) URL of tinymce.min.js as data-tinymce.
+ */
+(function () {
+    var loader = document.currentScript;
+
+    function init() {
+        var selector = 'textarea[data-editor="tinymce"]';
+        if (!document.querySelector(selector)) {
+            return;
+        }
+        var src = loader.getAttribute('data-tinymce');
+        var script = document.createElement('script');
+        script.src = src;
+        script.onload = function () {
+            tinymce.init({
+                selector: selector,
+                license_key: 'gpl',
+                // the hashed file name hides the location from TinyMCE
+                base_url: src.substring(0, src.lastIndexOf('/')),
+                suffix: '.min',
+                // versions the URLs of the plugins, skins and themes, which are cached for good
+                cache_suffix: '?v=' + tinymce.majorVersion + '.' + tinymce.minorVersion,
+                menubar: false,
+                promotion: false
+            });
+        };
+        document.head.appendChild(script);
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();
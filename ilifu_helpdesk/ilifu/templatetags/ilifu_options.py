@@ -0,0 +1,26 @@
+from django import template
+from django.conf import settings
+
+from ilifu import options
+
+register = template.Library()
+
+
+@register.simple_tag
+def owner_options(selected=None):
+    return options.owner_options(selected)
+
+
+@register.simple_tag
+def staff_options(selected=None, prefix=''):
+    return options.staff_options(selected or (), prefix)
+
+
+@register.simple_tag
+def kbitem_options(selected=None, prefix=''):
+    return options.kbitem_options(selected or (), prefix)
+
+
+@register.simple_tag
+def user_typeahead_enabled():
+    return getattr(settings, 'ILIFU_USER_TYPEAHEAD', False)
@@ -1,3 +1,616 @@
-from django.test import TestCase
+import base64
+import shutil
+import tempfile
+from datetime import timedelta
+from email.message import EmailMessage
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from helpdesk import settings as helpdesk_settings
+from helpdesk.models import (
+    Checklist,
+    ChecklistTask,
+    CustomField,
+    FollowUp,
+    FollowUpAttachment,
+    KBCategory,
+    KBItem,
+    Queue,
+    Ticket,
+    TicketCC,
+    TicketChange,
+    TicketCustomFieldValue,
+    TicketDependency,
+)
+
+from ilifu_helpdesk import urls
+
+from . import mass_update, options
+from .archive import archivable_tickets, archive_tickets, restore_ticket
+from .email_html import compact_email_files, compact_email_html
+from .middleware import PRIMARY_PIN_COOKIE, ReplicaRoutingMiddleware, StaticFilesMiddleware
+from .models import ArchivedTicket, InlineImage, MassUpdateJob
+from .routers import ReplicaRouter, use_replica
+from .ticket_context import get_ticket_context, get_ticket_queryset
+from .views import dashboard_async
+
+# the project's URLs with the dashboard served by dashboard_async, as with
+# ILIFU_ASYNC_DASHBOARD
+urlpatterns = [
+    path('dashboard/', dashboard_async, name='dashboard'),
+    *urls.urlpatterns,
+]
+
+WITH_REPLICA = {**settings.DATABASES, 'replica': {'ENGINE': 'django.db.backends.sqlite3'}}
+
+
+@override_settings(ROOT_URLCONF='ilifu.tests')
+class AsyncDashboardTests(TransactionTestCase):
+    # the dashboard sections query on threads of their own, which only see
+    # committed data
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('alice', email='alice@example.com', is_staff=True)
+        self.user.usersettings_helpdesk.tickets_per_page = 2
+        self.user.usersettings_helpdesk.save()
+        self.queue = Queue.objects.create(title='Queue', slug='q')
+        self.async_client.force_login(self.user)
+
+    def make_ticket(self, title, **kwargs):
+        return Ticket.objects.acreate(title=title, queue=self.queue, **kwargs)
+
+    async def test_page_renders_ticket_tables_and_defers_the_rest(self):
+        await self.make_ticket('Assigned ticket', assigned_to=self.user)
+        await self.make_ticket('Closed ticket', assigned_to=self.user, status=Ticket.CLOSED_STATUS)
+        await self.make_ticket('Submitted ticket', submitter_email='alice@example.com')
+        await self.make_ticket('Unassigned ticket')
+
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        for caption, title in (
+            ('Open Tickets assigned to you', 'Assigned ticket'),
+            ('Closed & resolved Tickets you used to work on', 'Closed ticket'),
+            ('All Tickets submitted by you', 'Submitted ticket'),
+            ('Unassigned Tickets', 'Unassigned ticket'),
+        ):
+            self.assertContains(response, caption)
+            self.assertContains(response, title)
+        self.assertContains(response, f'data-dashboard-fragment="{reverse("dashboard_stats")}"')
+        self.assertContains(response, f'data-dashboard-fragment="{reverse("dashboard_recent_activity")}"')
+        self.assertNotIn('basic_ticket_stats', response.context)
+        self.assertNotIn('recent_activity_tickets', response.context)
+
+    async def test_stats_fragment(self):
+        await self.make_ticket('Open ticket')
+        response = await self.async_client.get(reverse('dashboard_stats'))
+        self.assertTemplateUsed(response, 'helpdesk/include/stats.html')
+        self.assertEqual(sum(entry[1] for entry in response.context['basic_ticket_stats']['open_ticket_stats']), 1)
+
+    async def test_recent_activity_fragment_is_paginated(self):
+        for title in ('Oldest', 'Older', 'Newest'):
+            await self.make_ticket(f'{title} ticket')
+
+        response = await self.async_client.get(reverse('dashboard_recent_activity'), {'ra_page': 2})
+        self.assertContains(response, 'Recent Activity')
+        self.assertEqual([t.title for t in response.context['recent_activity_tickets']], ['Oldest ticket'])
+
+    async def test_staff_only(self):
+        await self.async_client.aforce_login(await get_user_model().objects.acreate(username='bob'))
+        for name in ('dashboard', 'dashboard_stats', 'dashboard_recent_activity'):
+            response = await self.async_client.get(reverse(name))
+            self.assertEqual(response.status_code, 302, name)
+
+
+@override_settings(DATABASES=WITH_REPLICA)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def route_read(self, request, model=Ticket):
+        """Return the alias a read of ``model`` is sent to while handling ``request``."""
+        seen = {}
+
+        def view(request):
+            seen['db'] = self.router.db_for_read(model)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return seen['db'], response
+
+    def test_read_heavy_view_uses_replica(self):
+        db, _ = self.route_read(self.factory.get(reverse('helpdesk:list')))
+        self.assertEqual(db, 'replica')
+
+    def test_other_views_use_primary(self):
+        db, _ = self.route_read(self.factory.get(reverse('helpdesk:view', args=[1])))
+        self.assertIsNone(db)
+
+    def test_users_are_never_read_from_replica(self):
+        db, _ = self.route_read(self.factory.get(reverse('helpdesk:list')), model=get_user_model())
+        self.assertIsNone(db)
+
+    def test_post_pins_to_primary(self):
+        db, response = self.route_read(self.factory.post(reverse('helpdesk:mass_update')))
+        self.assertIsNone(db)
+        self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+        request = self.factory.get(reverse('helpdesk:list'))
+        request.COOKIES[PRIMARY_PIN_COOKIE] = response.cookies[PRIMARY_PIN_COOKIE].value
+        db, _ = self.route_read(request)
+        self.assertIsNone(db)
+
+    def test_routing_is_reset_after_request(self):
+        self.route_read(self.factory.get(reverse('helpdesk:list')))
+        self.assertFalse(use_replica.get())
+        self.assertIsNone(self.router.db_for_read(Ticket))
+
+    def test_writes_and_migrations_use_primary(self):
+        self.assertEqual(self.router.db_for_write(Ticket), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'helpdesk'))
+        self.assertIsNone(self.router.allow_migrate('default', 'helpdesk'))
+
+    @override_settings(DATABASES={'default': settings.DATABASES['default']})
+    def test_no_replica_configured(self):
+        db, response = self.route_read(self.factory.post(reverse('helpdesk:list')))
+        self.assertIsNone(db)
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MassUpdateTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('alice', email='alice@example.com', is_staff=True)
+        self.bob = get_user_model().objects.create_user('bob', is_staff=True)
+        self.queue = Queue.objects.create(title='Queue', slug='q')
+        self.client.force_login(self.user)
+
+    def make_tickets(self, count, **kwargs):
+        return [
+            Ticket.objects.create(title=f'Ticket {i}', queue=self.queue, submitter_email='s@example.com', **kwargs)
+            for i in range(count)
+        ]
+
+    def post(self, tickets, action):
+        return self.client.post('/tickets/update/', {'ticket_id': [t.id for t in tickets], 'action': action})
+
+    def test_take_assign_and_unassign(self):
+        tickets = self.make_tickets(2)
+        self.assertRedirects(self.post(tickets, 'take'), reverse('helpdesk:list'), fetch_redirect_response=False)
+        self.assertEqual(Ticket.objects.filter(assigned_to=self.user).count(), 2)
+
+        self.post(tickets, f'assign_{self.bob.id}')
+        self.assertEqual(Ticket.objects.filter(assigned_to=self.bob).count(), 2)
+        change = TicketChange.objects.filter(followup__ticket=tickets[0]).latest('id')
+        self.assertEqual((change.old_value, change.new_value), ('alice', 'bob'))
+
+        self.post(tickets, 'unassign')
+        self.assertEqual(Ticket.objects.filter(assigned_to__isnull=True).count(), 2)
+        # one follow-up and one change per ticket and action
+        for ticket in tickets:
+            self.assertEqual(ticket.followup_set.count(), 3)
+            self.assertEqual(TicketChange.objects.filter(followup__ticket=ticket).count(), 3)
+
+    def test_set_kbitem(self):
+        category = KBCategory.objects.create(name='c', title='Category', slug='c', description='')
+        item = KBItem.objects.create(category=category, title='Item', question='?', answer='!')
+        tickets = self.make_tickets(2)
+        self.post(tickets, f'kbitem_{item.id}')
+        self.assertEqual(Ticket.objects.filter(kbitem=item).count(), 2)
+        self.assertEqual(TicketChange.objects.filter(new_value=str(item)).count(), 2)
+
+        self.post(tickets, 'kbitem_none')
+        self.assertEqual(Ticket.objects.filter(kbitem__isnull=True).count(), 2)
+
+    def test_close_and_close_public(self):
+        quiet, public = self.make_tickets(2)
+        self.post([quiet], 'close')
+        self.assertEqual(len(mail.outbox), 0)
+        self.post([public], 'close_public')
+        self.assertEqual([m.to for m in mail.outbox], [['s@example.com']])
+
+        for ticket, is_public in ((quiet, False), (public, True)):
+            ticket.refresh_from_db()
+            self.assertEqual(ticket.status, Ticket.CLOSED_STATUS)
+            followup = ticket.followup_set.get()
+            self.assertEqual((followup.new_status, followup.public), (Ticket.CLOSED_STATUS, is_public))
+            self.assertEqual(followup.ticketchange_set.get().new_value, 'Closed')
+
+    def test_delete(self):
+        tickets = self.make_tickets(2)
+        self.post(tickets[:1], 'delete')
+        self.assertEqual(list(Ticket.objects.all()), tickets[1:])
+
+    def test_merge_redirects_to_merge_view(self):
+        tickets = self.make_tickets(2)
+        response = self.post(tickets, 'merge')
+        self.assertRedirects(
+            response,
+            reverse('helpdesk:merge_tickets') + f'?tickets={tickets[0].id}&tickets={tickets[1].id}',
+            fetch_redirect_response=False,
+        )
+
+    @override_settings(ILIFU_MASS_UPDATE_BACKGROUND_THRESHOLD=1)
+    def test_unknown_actions_are_ignored(self):
+        tickets = self.make_tickets(2)
+        for action in ('bogus', 'assign_999', 'assign_', 'kbitem_999'):
+            self.assertRedirects(self.post(tickets, action), reverse('helpdesk:list'), fetch_redirect_response=False)
+        self.assertFalse(MassUpdateJob.objects.exists())
+        self.assertFalse(FollowUp.objects.exists())
+
+    @mock.patch.object(helpdesk_settings, 'HELPDESK_ENABLE_PER_QUEUE_STAFF_PERMISSION', True)
+    def test_only_tickets_in_permitted_queues_are_updated(self):
+        user = get_user_model().objects.create_user('carol')
+        other_queue = Queue.objects.create(title='Other', slug='other')
+        user.user_permissions.add(Permission.objects.get(codename=self.queue.permission_name.split('.')[1]))
+        allowed, = self.make_tickets(1)
+        denied = Ticket.objects.create(title='Other', queue=other_queue)
+
+        self.assertEqual(mass_update.run_mass_update(user, [allowed.id, denied.id], 'take'), 1)
+        self.assertEqual(Ticket.objects.get(id=allowed.id).assigned_to, user)
+        self.assertIsNone(Ticket.objects.get(id=denied.id).assigned_to)
+        self.assertFalse(denied.followup_set.exists())
+
+    @override_settings(ILIFU_MASS_UPDATE_CHUNK_SIZE=50)
+    def test_queries_per_chunk_are_constant(self):
+        category = KBCategory.objects.create(name='c', title='Category', slug='c', description='')
+        old, new = (KBItem.objects.create(category=category, title=t, question='?', answer='!') for t in 'ab')
+
+        def count_queries(tickets):
+            with CaptureQueriesContext(connection) as queries:
+                mass_update.run_mass_update(self.user, [t.id for t in tickets], f'kbitem_{new.id}')
+            return len(queries)
+
+        few = count_queries(self.make_tickets(2, kbitem=old))
+        self.assertEqual(count_queries(self.make_tickets(20, kbitem=old)), few)
+
+    @override_settings(ILIFU_MASS_UPDATE_BACKGROUND_THRESHOLD=3, ILIFU_MASS_UPDATE_CHUNK_SIZE=2)
+    def test_large_selections_run_as_a_job(self):
+        tickets = self.make_tickets(3)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post(tickets, 'take')
+        job = MassUpdateJob.objects.get()
+        self.assertRedirects(response, reverse('mass_update_progress', args=[job.id]), fetch_redirect_response=False)
+        self.assertEqual((job.status, job.total, job.ticket_ids), (MassUpdateJob.QUEUED, 3, [t.id for t in tickets]))
+        self.assertEqual(len(callbacks), 1)
+
+        mass_update.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (MassUpdateJob.DONE, 3))
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(Ticket.objects.filter(assigned_to=self.user).count(), 3)
+
+        response = self.client.get(reverse('mass_update_progress', args=[job.id]), {'format': 'json'})
+        self.assertEqual(response.json(), {'status': 'done', 'processed': 3, 'total': 3, 'error': None})
+
+    def make_job(self, tickets, **kwargs):
+        return MassUpdateJob.objects.create(
+            user=self.user, action='take', ticket_ids=[t.id for t in tickets], total=len(tickets), **kwargs
+        )
+
+    @override_settings(ILIFU_MASS_UPDATE_CHUNK_SIZE=2)
+    def test_failed_job_records_its_progress_and_error(self):
+        job = self.make_job(self.make_tickets(3))
+        update_chunk = mass_update._update_chunk
+
+        def fail_second_chunk(tickets, *args):
+            if len(tickets) == 1:
+                raise RuntimeError('Disk full')
+            return update_chunk(tickets, *args)
+
+        with mock.patch.object(mass_update, '_update_chunk', side_effect=fail_second_chunk):
+            with self.assertLogs('ilifu.mass_update', 'ERROR'):
+                mass_update.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.error), (MassUpdateJob.FAILED, 2, 'Disk full'))
+        self.assertEqual(Ticket.objects.filter(assigned_to=self.user).count(), 2)
+
+    def test_job_runs_only_once(self):
+        job = self.make_job(self.make_tickets(1), status=MassUpdateJob.RUNNING, heartbeat=timezone.now())
+        mass_update.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (MassUpdateJob.RUNNING, 0))
+        self.assertFalse(Ticket.objects.filter(assigned_to=self.user).exists())
+
+    def test_stale_jobs_are_resumed(self):
+        done, *remaining = self.make_tickets(3)
+        stale = self.make_job(
+            [done, *remaining], status=MassUpdateJob.RUNNING, processed=1,
+            heartbeat=timezone.now() - timedelta(hours=1),
+        )
+        live = self.make_job(remaining, status=MassUpdateJob.RUNNING, heartbeat=timezone.now())
+
+        call_command('run_mass_update_jobs', stdout=StringIO())
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((stale.status, stale.processed), (MassUpdateJob.DONE, 3))
+        self.assertEqual(live.status, MassUpdateJob.RUNNING)
+        # the tickets processed before the thread died are not updated again
+        self.assertIsNone(Ticket.objects.get(id=done.id).assigned_to)
+        self.assertEqual(Ticket.objects.filter(assigned_to=self.user).count(), 2)
+
+
+class MassUpdateEmailTests(TransactionTestCase):
+    def test_close_emails_are_sent_after_commit(self):
+        user = get_user_model().objects.create_user('alice', is_staff=True)
+        queue = Queue.objects.create(title='Queue', slug='q')
+        ticket = Ticket.objects.create(title='Ticket', queue=queue, submitter_email='s@example.com')
+        send_close_emails = mass_update._send_close_emails
+        seen = []
+
+        def record(tickets, user):
+            seen.append((connection.in_atomic_block, Ticket.objects.get(id=ticket.id).status))
+            send_close_emails(tickets, user)
+
+        with mock.patch.object(mass_update, '_send_close_emails', side_effect=record):
+            mass_update.run_mass_update(user, [ticket.id], 'close_public')
+        self.assertEqual(seen, [(False, Ticket.CLOSED_STATUS)])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class OptionsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = get_user_model().objects.create_user('alice', is_staff=True)
+        self.bob = get_user_model().objects.create_user('bob', is_staff=True)
+
+    def test_options_are_cached(self):
+        options.owner_options()
+        with self.assertNumQueries(0):
+            html = options.owner_options(self.bob.id)
+        self.assertIn(f"<option value='{self.alice.id}'>alice</option>", html)
+        self.assertIn(f"<option value='{self.bob.id}' selected>bob</option>", html)
+
+    def test_prefixed_staff_options(self):
+        html = options.staff_options(prefix='assign_')
+        self.assertIn(f"<option value='assign_{self.alice.id}'>alice</option>", html)
+
+    def test_user_changes_invalidate_options(self):
+        options.staff_options()
+        self.bob.is_active = False
+        self.bob.save()
+        self.assertNotIn('bob', options.staff_options())
+
+    def test_login_does_not_invalidate_options(self):
+        options.staff_options()
+        self.alice.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            options.staff_options()
+
+    def test_ticket_list_queries_do_not_grow_with_kb_items(self):
+        self.client.force_login(self.alice)
+        category = KBCategory.objects.create(name='c', title='Category', slug='c', description='')
+
+        def count_queries(kb_items):
+            for i in range(kb_items):
+                KBItem.objects.create(category=category, title=f'Item {i}', question='?', answer='!')
+            self.client.get(reverse('helpdesk:list'))  # fill the caches
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('helpdesk:list'), {'kbitem': [KBItem.objects.first().id]})
+            self.assertContains(response, 'Category: Item 0')
+            return len(queries)
+
+        few = count_queries(1)
+        self.assertEqual(count_queries(20), few)
+
+    @mock.patch.object(helpdesk_settings, 'HELPDESK_KB_ENABLED', False)
+    def test_ticket_list_has_no_kb_items_without_kb(self):
+        self.client.force_login(self.alice)
+        category = KBCategory.objects.create(name='c', title='Category', slug='c', description='')
+        KBItem.objects.create(category=category, title='Item', question='?', answer='!')
+        self.assertNotContains(self.client.get(reverse('helpdesk:list')), 'Category: Item')
+
+    def test_selected_kbitem_options(self):
+        category = KBCategory.objects.create(name='c', title='Category', slug='c', description='')
+        item = KBItem.objects.create(category=category, title='Item', question='?', answer='!')
+        self.assertIn(f"<option value='{item.id}' selected>Category: Item</option>", options.kbitem_options([item.id]))
+
+
+class TicketContextTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('alice', is_staff=True, is_superuser=True)
+        self.queue = Queue.objects.create(title='Queue', slug='q')
+
+    def make_ticket(self, size):
+        """A ticket with ``size`` custom fields, dependencies, CCs and checklist tasks."""
+        ticket = Ticket.objects.create(title=f'Ticket {size}', queue=self.queue, submitter_email='a@example.com')
+        for i in range(size):
+            field = CustomField.objects.create(name=f'field_{size}_{i}', label=f'Field {i}', data_type='varchar')
+            TicketCustomFieldValue.objects.create(ticket=ticket, field=field, value=str(i))
+            other = Ticket.objects.create(title=f'Other {i}', queue=self.queue)
+            TicketDependency.objects.create(ticket=ticket, depends_on=other)
+            TicketDependency.objects.create(ticket=other, depends_on=ticket)
+            TicketCC.objects.create(ticket=ticket, email=f'cc{i}@example.com')
+            checklist = Checklist.objects.create(ticket=ticket, name=f'Checklist {i}')
+            for position in range(size):
+                ChecklistTask.objects.create(
+                    checklist=checklist,
+                    description=f'Task {position}',
+                    position=position,
+                    completion_date=timezone.now() if position % 2 else None,
+                )
+        return ticket
+
+    def count_header_queries(self, ticket):
+        request = RequestFactory().get(reverse('helpdesk:view', args=[ticket.id]))
+        request.user = self.user
+        with CaptureQueriesContext(connection) as queries:
+            ticket = get_ticket_queryset().get(id=ticket.id)
+            html = render_to_string(
+                'helpdesk/ticket_desc_table.html',
+                get_ticket_context(self.user, ticket),
+                request=request,
+            )
+        return len(queries), html
+
+    def test_header_queries_do_not_grow_with_ticket(self):
+        small, _ = self.count_header_queries(self.make_ticket(1))
+        large, html = self.count_header_queries(self.make_ticket(6))
+        self.assertEqual(small, large)
+        self.assertIn('cc5@example.com', html)
+        self.assertIn('Field 5', html)
+        self.assertIn('50%', html)
+
+
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+class EmailHtmlTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, ILIFU_EMAIL_MAX_STYLE_SIZE=200)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_data_images_are_stored_once(self):
+        data_uri = 'data:image/png;base64,' + base64.b64encode(PNG).decode()
+        html, _ = compact_email_html(
+            f'<p><img src="{data_uri}"></p><div style="background: url({data_uri})"></div>'
+        )
+        image = InlineImage.objects.get()
+        self.assertNotIn('base64', html)
+        self.assertEqual(html.count(image.get_absolute_url()), 2)
+
+        response = self.client.get(image.get_absolute_url())
+        self.assertEqual(b''.join(response.streaming_content), PNG)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get(image.get_absolute_url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_dead_markup_and_oversized_styles_are_stripped(self):
+        html, _ = compact_email_html(
+            '<style>p {}</style><style>' + 'p {}' * 50 + '</style>'
+            '<!--[if mso]><table></table><![endif]--><o:p></o:p><script>x()</script>'
+            '<p style="' + 'color: red;' * 20 + '">Hello</p>'
+        )
+        self.assertEqual(html, '<style>p {}</style><p>Hello</p>')
+
+    def test_comments_inside_outlook_styles_are_kept(self):
+        style = '<style><!--\n/* Style Definitions */\np.MsoNormal {margin: 0cm;}\n--></style>'
+        html, _ = compact_email_html(
+            f'<html><head>{style}<!--[if gte mso 9]><xml><o:shapedefaults /></xml><![endif]--></head>'
+            '<body><p class="MsoNormal">Hello<o:p></o:p></p><!-- signature --></body></html>'
+        )
+        self.assertEqual(html, f'<html><head>{style}</head><body><p class="MsoNormal">Hello</p></body></html>')
+
+    def test_svg_images_stay_inline(self):
+        html = '<img src="data:image/svg+xml;base64,PHN2Zz48L3N2Zz4=">'
+        self.assertEqual(compact_email_html(html)[0], html)
+        self.assertFalse(InlineImage.objects.exists())
+
+    def test_cid_images_replace_their_attachments(self):
+        message = EmailMessage()
+        message.set_content('Hello')
+        message.add_alternative('<p>Hello <img src="cid:logo@example.com"></p>', subtype='html')
+        message.get_payload()[1].add_related(PNG, 'image', 'png', cid='<logo@example.com>')
+        files = [
+            SimpleUploadedFile('email_html_body.html', message.get_body(('html',)).get_content().encode()),
+            SimpleUploadedFile('part-1.png', PNG, 'image/png'),
+            SimpleUploadedFile('report.pdf', b'%PDF', 'application/pdf'),
+        ]
+
+        files = compact_email_files(message, files)
+
+        self.assertEqual([f.name for f in files], ['email_html_body.html', 'report.pdf'])
+        self.assertIn(InlineImage.objects.get().get_absolute_url(), files[0].read().decode())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('alice', is_staff=True, is_superuser=True)
+        self.queue = Queue.objects.create(title='Queue', slug='q')
+
+    def make_ticket(self, status=Ticket.CLOSED_STATUS, age=timedelta(days=3 * 365)):
+        ticket = Ticket.objects.create(title='Old', queue=self.queue, status=status, submitter_email='a@example.com')
+        followup = FollowUp.objects.create(ticket=ticket, title='Closed', comment='All done', user=self.user)
+        TicketChange.objects.create(followup=followup, field='Status', old_value='Open', new_value='Closed')
+        FollowUpAttachment.objects.create(
+            followup=followup, file='helpdesk/attachments/log.txt', filename='log.txt', mime_type='text/plain', size=3
+        )
+        TicketCC.objects.create(ticket=ticket, email='cc@example.com')
+        Ticket.objects.filter(id=ticket.id).update(modified=timezone.now() - age)
+        return ticket
+
+    def test_only_old_closed_tickets_are_archivable(self):
+        old = self.make_ticket()
+        self.make_ticket(status=Ticket.OPEN_STATUS)
+        self.make_ticket(age=timedelta(days=1))
+        self.assertEqual(list(archivable_tickets()), [old])
+
+    def test_archive_and_restore(self):
+        ticket = self.make_ticket()
+        other = Ticket.objects.create(title='Open', queue=self.queue)
+        TicketDependency.objects.create(ticket=ticket, depends_on=other)
+
+        self.assertEqual(archive_tickets(), 1)
+        self.assertFalse(Ticket.objects.filter(id=ticket.id).exists())
+        self.assertFalse(FollowUp.objects.exists())
+        archived = ArchivedTicket.objects.get(id=ticket.id)
+        self.assertEqual(archived.followups.count(), 1)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('helpdesk:view', args=[ticket.id]))
+        self.assertTemplateUsed(response, 'helpdesk/archived_ticket.html')
+        self.assertContains(response, 'All done')
+        self.assertContains(response, 'log.txt')
+
+        restored = restore_ticket(archived)
+        self.assertEqual(restored.id, ticket.id)
+        self.assertFalse(ArchivedTicket.objects.exists())
+        ticket = Ticket.objects.get(id=ticket.id)
+        self.assertEqual(ticket.ticketcc_set.get().email, 'cc@example.com')
+        followup = ticket.followup_set.get()
+        self.assertEqual(followup.user, self.user)
+        self.assertEqual(followup.ticketchange_set.get().new_value, 'Closed')
+        self.assertEqual(followup.followupattachment_set.get().filename, 'log.txt')
+        self.assertTrue(TicketDependency.objects.filter(ticket=ticket, depends_on=other).exists())
+
+    def test_tickets_others_depend_on_are_kept(self):
+        ticket = self.make_ticket()
+        other = Ticket.objects.create(title='Open', queue=self.queue)
+        TicketDependency.objects.create(ticket=other, depends_on=ticket)
+
+        self.assertEqual(archive_tickets(), 0)
+        self.assertEqual([dependency.depends_on for dependency in other.ticketdependency.all()], [ticket])
+
+    @override_settings(ILIFU_ARCHIVE_CHUNK_SIZE=1)
+    def test_tickets_changed_during_the_run_are_kept(self):
+        first, reopened, merged_into = self.make_ticket(), self.make_ticket(), self.make_ticket()
+
+        def progress(archived):
+            # after the first chunk, as if another request got in between
+            if archived == 1:
+                Ticket.objects.filter(id=reopened.id).update(status=Ticket.REOPENED_STATUS)
+                Ticket.objects.create(
+                    title='Duplicate', queue=self.queue, status=Ticket.DUPLICATE_STATUS, merged_to=merged_into
+                )
+
+        self.assertEqual(archive_tickets(progress=progress), 1)
+        self.assertEqual(list(ArchivedTicket.objects.values_list('id', flat=True)), [first.id])
+        self.assertEqual(Ticket.objects.filter(id__in=[reopened.id, merged_into.id]).count(), 2)
+
+
+class StaticFilesTests(SimpleTestCase):
+    def test_tinymce_files_are_cached_for_good(self):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse())
+        self.assertTrue(middleware.immutable_file_test(
+            None, '/static/tinymce/js/tinymce/plugins/link/plugin.min.js'
+        ))
+        self.assertFalse(middleware.immutable_file_test(None, '/static/ilifu/js/editor.js'))
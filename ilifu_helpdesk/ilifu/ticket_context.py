@@ -0,0 +1,90 @@
+"""
+Assembles the context of the ticket page with a fixed number of queries.
+
+Left to the templates, the ticket header (helpdesk/ticket_desc_table.html)
+and the checklist editor query the custom field values and their field
+definitions, both directions of the dependencies, the CCs and every
+checklist's tasks one item at a time. Here all of that is loaded up front,
+one prefetch query per relation, so the cost of the page no longer grows
+with the number of custom fields, dependencies or checklist tasks.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Case, Prefetch, When, prefetch_related_objects
+from django.urls import reverse
+from helpdesk.models import (
+    Checklist,
+    FollowUp,
+    Ticket,
+    TicketCC,
+    TicketCustomFieldValue,
+    TicketDependency,
+)
+from helpdesk.update_ticket import return_ticketccstring_and_show_subscribe
+
+TICKET_SELECT_RELATED = ('queue', 'assigned_to', 'kbitem', 'merged_to')
+
+
+def prefetch_ticket(ticket):
+    """Load the related objects the ticket page iterates over into ``ticket``'s prefetch cache."""
+    prefetch_related_objects(
+        [ticket],
+        Prefetch(
+            'ticketcustomfieldvalue_set',
+            queryset=TicketCustomFieldValue.objects.select_related('field'),
+        ),
+        # the tickets this ticket resolves
+        Prefetch('depends_on', queryset=TicketDependency.objects.select_related('ticket__queue')),
+        Prefetch('ticketcc_set', queryset=TicketCC.objects.select_related('user')),
+        Prefetch('checklists', queryset=Checklist.objects.prefetch_related('tasks')),
+        Prefetch(
+            'followup_set',
+            queryset=FollowUp.objects.select_related('user').prefetch_related(
+                'followupattachment_set', 'ticketchange_set'
+            ),
+        ),
+    )
+
+
+def get_ticket_queryset():
+    """Tickets with what the header of the ticket page shows joined in."""
+    return Ticket.objects.select_related(*TICKET_SELECT_RELATED)
+
+
+def get_ticket_dependencies(ticket):
+    """The tickets ``ticket`` depends on, open ones first, as helpdesk's view_ticket orders them."""
+    return list(
+        ticket.ticketdependency.select_related('depends_on__queue').annotate(
+            rank=Case(When(depends_on__status__in=Ticket.OPEN_STATUSES, then=1), default=2)
+        ).order_by('rank')
+    )
+
+
+def get_submitter_userprofile_url(ticket):
+    submitter_userprofile = ticket.get_submitter_userprofile()
+    if submitter_userprofile is None:
+        return None
+    content_type = ContentType.objects.get_for_model(submitter_userprofile)
+    return reverse(
+        "admin:{app}_{model}_change".format(
+            app=content_type.app_label, model=content_type.model
+        ),
+        kwargs={"object_id": submitter_userprofile.id},
+    )
+
+
+def get_ticket_context(user, ticket):
+    """
+    The parts of the ticket page's context that describe ``ticket``.
+
+    ``ticket`` should come from :func:`get_ticket_queryset`; its related
+    objects are prefetched here so that the templates find them cached.
+    """
+    prefetch_ticket(ticket)
+    ticketcc_string, show_subscribe = return_ticketccstring_and_show_subscribe(user, ticket)
+    return {
+        "ticket": ticket,
+        "dependencies": get_ticket_dependencies(ticket),
+        "submitter_userprofile_url": get_submitter_userprofile_url(ticket),
+        "ticketcc_string": ticketcc_string,
+        "SHOW_SUBSCRIBE": show_subscribe,
+    }
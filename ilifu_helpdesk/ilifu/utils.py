@@ -13,6 +13,8 @@ from helpdesk.lib import process_attachments, safe_template_context
 from helpdesk.models import FollowUp, Ticket
 from helpdesk.signals import new_ticket_done, update_ticket_done
 
+from .email_html import compact_email_files
+
 
 logger = logging.getLogger(__name__)
 
@@ -201,6 +203,11 @@ def custom_create_object_from_email_message(message, ticket_id, payload, files,
     )
 
     if helpdesk_settings.HELPDESK_ENABLE_ATTACHMENTS:
+        try:
+            files = compact_email_files(message, files)
+        except Exception as e:
+            # store the body as received rather than lose it
+            logger.error(f"Error externalizing the images of the HTML body for FollowUp {f.id}: {e}")
         try:
             attached = process_attachments(f, files)
         except ValidationError as e:
@@ -1,19 +1,55 @@
+import asyncio
+from copy import deepcopy
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import user_passes_test
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.shortcuts import render
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import FileResponse, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils.translation import gettext as _
+from django.views.decorators.http import etag
 
 from helpdesk import settings as helpdesk_settings
 from helpdesk.decorators import (
     helpdesk_staff_member_required,
 )
-from helpdesk.query import get_query_class
+from helpdesk.forms import (
+    CreateChecklistForm,
+    EditTicketCustomFieldForm,
+    TicketForm,
+)
 from helpdesk.models import (
+    PreSetReply,
+    SavedSearch,
     Ticket,
 )
+from helpdesk.query import get_query_class, query_to_base64
+from helpdesk.update_ticket import (
+    return_ticketccstring_and_show_subscribe,
+    subscribe_to_ticket_updates,
+    update_ticket,
+)
 from helpdesk.user import HelpdeskUser
-from helpdesk.views.staff import calc_basic_ticket_stats
+from helpdesk.views.staff import (
+    calc_basic_ticket_stats,
+    check_redirect_on_user_query,
+    get_form_extra_kwargs,
+    load_saved_query,
+    QueryLoadError,
+    return_to_ticket,
+    ticket_perm_check,
+)
+
+from .archive import load_archived_ticket
+from .mass_update import get_background_threshold, parse_action, run_mass_update, start_job
+from .models import ArchivedTicket, InlineImage, MassUpdateJob
+from .options import search_users
+from .ticket_context import get_ticket_context, get_ticket_queryset
 
 
 User = get_user_model()
@@ -32,27 +68,29 @@ else:
 
 # Create your views here.
 
-@helpdesk_staff_member_required
-def dashboard(request):
-    """
-    A quick summary overview for users: A list of their own tickets, a table
-    showing ticket counts by queue/status, and a list of unassigned tickets
-    with options for them to 'Take' ownership of said tickets.
-    """
+def _get_tickets_per_page(user):
     # user settings num tickets per page
-    if request.user.is_authenticated and hasattr(request.user, "usersettings_helpdesk"):
-        tickets_per_page = request.user.usersettings_helpdesk.tickets_per_page
-    else:
-        tickets_per_page = 25
+    if user.is_authenticated and hasattr(user, "usersettings_helpdesk"):
+        return user.usersettings_helpdesk.tickets_per_page
+    return 25
 
-    # page vars for the three ticket tables
-    user_tickets_page = request.GET.get(_("ut_page"), 1)
-    user_tickets_closed_resolved_page = request.GET.get(_("utcr_page"), 1)
-    all_tickets_reported_by_current_user_page = request.GET.get(_("atrbcu_page"), 1)
-    recent_activity_page = request.GET.get(_('ra_page'), 1)
 
-    huser = HelpdeskUser(request.user)
-    active_tickets = Ticket.objects.select_related("queue").exclude(
+def _paginate(queryset, page, per_page):
+    """Return the requested page of ``queryset`` with its rows already fetched."""
+    paginator = Paginator(queryset, per_page)
+    try:
+        result = paginator.page(page)
+    except PageNotAnInteger:
+        result = paginator.page(1)
+    except EmptyPage:
+        result = paginator.page(paginator.num_pages)
+    # evaluate here so the template never touches the database for the list
+    result.object_list = list(result.object_list)
+    return result
+
+
+def _get_active_tickets():
+    return Ticket.objects.select_related("queue").exclude(
         status__in=[
             Ticket.CLOSED_STATUS,
             Ticket.RESOLVED_STATUS,
@@ -60,37 +98,39 @@ def dashboard(request):
         ],
     )
 
+
+# Each dashboard section below is independent of the others, takes only plain
+# arguments and returns the part of the template context it is responsible
+# for. That lets the synchronous view run them one after the other and the
+# asynchronous view run them side by side.
+
+def _assigned_section(user, page, tickets_per_page):
     # open & reopened tickets, assigned to current user
-    tickets = active_tickets.filter(
-        assigned_to=request.user,
+    tickets = _get_active_tickets().filter(
+        assigned_to=user,
     ).order_by('-modified')
+    return {"user_tickets": _paginate(tickets, page, tickets_per_page)}
+
 
+def _closed_resolved_section(user, page, tickets_per_page):
     # closed & resolved tickets, assigned to current user
     tickets_closed_resolved = Ticket.objects.select_related("queue").filter(
-        assigned_to=request.user,
+        assigned_to=user,
         status__in=[
             Ticket.CLOSED_STATUS,
             Ticket.RESOLVED_STATUS,
             Ticket.DUPLICATE_STATUS,
         ],
     ).order_by('-modified')
+    return {
+        "user_tickets_closed_resolved": _paginate(tickets_closed_resolved, page, tickets_per_page),
+    }
 
-    recent_activity_tickets = Ticket.objects.all().select_related("queue").order_by('-modified')
-
-    user_queues = huser.get_queues()
-
-    unassigned_tickets = active_tickets.filter(
-        assigned_to__isnull=True, queue__in=user_queues
-    )
-    kbitems = None
-    # Teams mode uses assignment via knowledge base items so exclude tickets assigned to KB items
-    if helpdesk_settings.HELPDESK_TEAMS_MODE_ENABLED:
-        unassigned_tickets = unassigned_tickets.filter(kbitem__isnull=True)
-        kbitems = huser.get_assigned_kb_items()
 
+def _submitted_section(user, page, tickets_per_page):
     # all tickets, reported by current user
     all_tickets_reported_by_current_user = ""
-    email_current_user = request.user.email
+    email_current_user = user.email
     if email_current_user:
         all_tickets_reported_by_current_user = (
             Ticket.objects.select_related("queue")
@@ -99,78 +139,496 @@ def dashboard(request):
             )
             .order_by("status")
         )
+    return {
+        "all_tickets_reported_by_current_user": _paginate(
+            all_tickets_reported_by_current_user, page, tickets_per_page
+        ),
+    }
+
+
+def _unassigned_section(user):
+    huser = HelpdeskUser(user)
+    unassigned_tickets = _get_active_tickets().filter(
+        assigned_to__isnull=True, queue__in=huser.get_queues()
+    )
+    kbitems = None
+    # Teams mode uses assignment via knowledge base items so exclude tickets assigned to KB items
+    if helpdesk_settings.HELPDESK_TEAMS_MODE_ENABLED:
+        unassigned_tickets = unassigned_tickets.filter(kbitem__isnull=True)
+        kbitems = huser.get_assigned_kb_items()
+    return {
+        "unassigned_tickets": list(unassigned_tickets),
+        "kbitems": kbitems,
+    }
+
+
+def _recent_activity_section(page, tickets_per_page):
+    recent_activity_tickets = Ticket.objects.all().select_related("queue").order_by('-modified')
+    return {
+        "recent_activity_tickets": _paginate(recent_activity_tickets, page, tickets_per_page),
+    }
+
 
+def _stats_section(user):
     tickets_in_queues = Ticket.objects.filter(
-        queue__in=user_queues,
+        queue__in=HelpdeskUser(user).get_queues(),
     )
-    basic_ticket_stats = calc_basic_ticket_stats(tickets_in_queues)
-
-    # The following query builds a grid of queues & ticket statuses,
-    # to be displayed to the user. EG:
-    #          Open  Resolved
-    # Queue 1    10     4
-    # Queue 2     4    12
-    # code never used (and prone to sql injections)
-    # queues = HelpdeskUser(request.user).get_queues().values_list('id', flat=True)
-    # from_clause = """FROM    helpdesk_ticket t,
-    #                 helpdesk_queue q"""
-    # if queues:
-    #     where_clause = """WHERE   q.id = t.queue_id AND
-    #                     q.id IN (%s)""" % (",".join(("%d" % pk for pk in queues)))
-    # else:
-    #     where_clause = """WHERE   q.id = t.queue_id"""
-
-    # get user assigned tickets page
-    paginator = Paginator(tickets, tickets_per_page)
+    return {"basic_ticket_stats": calc_basic_ticket_stats(tickets_in_queues)}
+
+
+def _run_section_in_own_thread(section, *args):
+    """
+    Run a dashboard section on an executor thread. Django connections are
+    per-thread, so each section gets its own database connection; tidy it up
+    the way the request signals would for a normal request thread.
+    """
+    close_old_connections()
     try:
-        tickets = paginator.page(user_tickets_page)
-    except PageNotAnInteger:
-        tickets = paginator.page(1)
-    except EmptyPage:
-        tickets = paginator.page(paginator.num_pages)
+        return section(*args)
+    finally:
+        close_old_connections()
+
+
+async def _gather_sections(*sections):
+    """
+    Evaluate ``(section, args)`` pairs concurrently and merge their contexts.
+
+    Django's async queryset methods all funnel into the single thread-sensitive
+    executor, so awaiting several of them together would still run the queries
+    one after another. Running every section with ``thread_sensitive=False``
+    gives each one its own thread and connection, so the sections really do
+    overlap and the total time is roughly that of the slowest one.
+    """
+    results = await asyncio.gather(*(
+        sync_to_async(_run_section_in_own_thread, thread_sensitive=False)(section, *args)
+        for section, args in sections
+    ))
+    context = {}
+    for result in results:
+        context.update(result)
+    return context
+
+
+def _get_page_numbers(request):
+    # page vars for the ticket tables
+    return {
+        "user_tickets_page": request.GET.get(_("ut_page"), 1),
+        "user_tickets_closed_resolved_page": request.GET.get(_("utcr_page"), 1),
+        "all_tickets_reported_by_current_user_page": request.GET.get(_("atrbcu_page"), 1),
+        "recent_activity_page": request.GET.get(_('ra_page'), 1),
+    }
+
+
+@helpdesk_staff_member_required
+def dashboard(request):
+    """
+    A quick summary overview for users: A list of their own tickets, a table
+    showing ticket counts by queue/status, and a list of unassigned tickets
+    with options for them to 'Take' ownership of said tickets.
+    """
+    user = request.user
+    tickets_per_page = _get_tickets_per_page(user)
+    pages = _get_page_numbers(request)
+
+    context = {}
+    context.update(_assigned_section(user, pages["user_tickets_page"], tickets_per_page))
+    context.update(_closed_resolved_section(
+        user, pages["user_tickets_closed_resolved_page"], tickets_per_page
+    ))
+    context.update(_unassigned_section(user))
+    context.update(_submitted_section(
+        user, pages["all_tickets_reported_by_current_user_page"], tickets_per_page
+    ))
+    context.update(_stats_section(user))
+    context.update(_recent_activity_section(pages["recent_activity_page"], tickets_per_page))
+
+    return render(request, "helpdesk/dashboard.html", context)
+
+
+dashboard = staff_member_required(dashboard)
+
+
+@helpdesk_staff_member_required
+async def dashboard_async(request):
+    """
+    Asynchronous variant of :func:`dashboard` for use under ASGI.
+
+    The ticket tables are queried concurrently, while the slow stats and
+    recent activity sections are left out of the page entirely and fetched by
+    the browser from :func:`dashboard_stats` and
+    :func:`dashboard_recent_activity` once the page has loaded.
+    """
+    user = await request.auser()
+    tickets_per_page = await sync_to_async(_get_tickets_per_page)(user)
+    pages = _get_page_numbers(request)
+
+    context = await _gather_sections(
+        (_assigned_section, (user, pages["user_tickets_page"], tickets_per_page)),
+        (_closed_resolved_section, (
+            user, pages["user_tickets_closed_resolved_page"], tickets_per_page
+        )),
+        (_unassigned_section, (user,)),
+        (_submitted_section, (
+            user, pages["all_tickets_reported_by_current_user_page"], tickets_per_page
+        )),
+    )
+    context["deferred_sections"] = True
+
+    return await sync_to_async(render)(request, "helpdesk/dashboard.html", context)
+
+
+dashboard_async = staff_member_required(dashboard_async)
+
+
+@helpdesk_staff_member_required
+def dashboard_stats(request):
+    """The ticket age stats cards of the dashboard, as a standalone fragment."""
+    return render(request, "helpdesk/include/stats.html", _stats_section(request.user))
+
+
+dashboard_stats = staff_member_required(dashboard_stats)
+
+
+@helpdesk_staff_member_required
+def dashboard_recent_activity(request):
+    """The recent activity table of the dashboard, as a standalone fragment."""
+    return render(
+        request,
+        "helpdesk/include/dashboard_recent_activity.html",
+        _recent_activity_section(
+            _get_page_numbers(request)["recent_activity_page"],
+            _get_tickets_per_page(request.user),
+        ),
+    )
+
+
+dashboard_recent_activity = staff_member_required(dashboard_recent_activity)
+
+
+@helpdesk_staff_member_required
+def mass_update(request):
+    """
+    Replacement for helpdesk's mass_update that applies the action in bulk
+    (see ilifu.mass_update). Large selections are handed to a background job
+    and the user is sent to its progress page.
+    """
+    ticket_ids = [int(ticket_id) for ticket_id in request.POST.getlist("ticket_id") if ticket_id.isdigit()]
+    action = request.POST.get("action", None)
+    if not (ticket_ids and action):
+        return HttpResponseRedirect(reverse("helpdesk:list"))
+
+    if action == "merge":
+        # Redirect to the Merge View with selected tickets id in the GET
+        # request
+        return redirect(
+            reverse("helpdesk:merge_tickets")
+            + "?"
+            + "&".join(["tickets=%s" % ticket_id for ticket_id in ticket_ids])
+        )
 
-    # get user completed tickets page
-    paginator = Paginator(tickets_closed_resolved, tickets_per_page)
     try:
-        tickets_closed_resolved = paginator.page(user_tickets_closed_resolved_page)
-    except PageNotAnInteger:
-        tickets_closed_resolved = paginator.page(1)
-    except EmptyPage:
-        tickets_closed_resolved = paginator.page(paginator.num_pages)
+        parse_action(action, request.user)
+    except ValueError:
+        # helpdesk's mass_update ignores actions it does not know
+        return HttpResponseRedirect(reverse("helpdesk:list"))
+
+    if len(ticket_ids) < get_background_threshold():
+        run_mass_update(request.user, ticket_ids, action)
+        return HttpResponseRedirect(reverse("helpdesk:list"))
+
+    job = MassUpdateJob.objects.create(
+        user=request.user,
+        action=action,
+        ticket_ids=ticket_ids,
+        total=len(ticket_ids),
+    )
+    start_job(job)
+    return redirect("mass_update_progress", job.id)
+
+
+mass_update = staff_member_required(mass_update)
+
+
+@helpdesk_staff_member_required
+def mass_update_progress(request, job_id):
+    """Progress of a background mass update; as JSON for polling when ``?format=json``."""
+    job = get_object_or_404(MassUpdateJob, id=job_id, user=request.user)
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "status": job.status,
+            "processed": job.processed,
+            "total": job.total,
+            "error": job.error,
+        })
+    return render(request, "helpdesk/mass_update_progress.html", {"job": job})
+
+
+mass_update_progress = staff_member_required(mass_update_progress)
+
+
+@helpdesk_staff_member_required
+def user_search(request):
+    """Possible ticket owners matching ``?q=``, for the owner typeahead on the ticket page."""
+    return JsonResponse(
+        [{"id": u.id, "label": str(u)} for u in search_users(request.GET.get("q", ""))],
+        safe=False,
+    )
+
+
+user_search = staff_member_required(user_search)
+
+
+@helpdesk_staff_member_required
+def ticket_list(request):
+    """
+    helpdesk's ticket_list without the KB item choices: it builds them with
+    one query per item for the category in each label, whereas the
+    filters/kbitems.html override renders the cached ilifu.options ones.
+    """
+    context = {}
+
+    huser = HelpdeskUser(request.user)
+
+    # Query_params will hold a dictionary of parameters relating to
+    # a query, to be saved if needed:
+    query_params = {
+        "filtering": {},
+        "filtering_null": {},
+        "sorting": None,
+        "sortreverse": False,
+        "search_string": "",
+    }
+    default_query_params = {
+        "filtering": {
+            "status__in": [1, 2],
+        },
+        "sorting": "created",
+        "search_string": "",
+        "sortreverse": False,
+    }
 
-    # get user submitted tickets page
-    paginator = Paginator(all_tickets_reported_by_current_user, tickets_per_page)
+    #: check for a redirect, see function doc for details
+    user_query_redirect = check_redirect_on_user_query(request, huser)
+    if user_query_redirect:
+        return user_query_redirect
     try:
-        all_tickets_reported_by_current_user = paginator.page(
-            all_tickets_reported_by_current_user_page
+        saved_query, query_params = load_saved_query(request, query_params)
+    except QueryLoadError:
+        return HttpResponseRedirect(reverse("helpdesk:list"))
+
+    if saved_query:
+        pass
+    elif not {
+        "queue",
+        "assigned_to",
+        "status",
+        "q",
+        "sort",
+        "sortreverse",
+        "kbitem",
+    }.intersection(request.GET):
+        # Fall-back if no querying is being done
+        query_params = deepcopy(default_query_params)
+    else:
+        filter_in_params = [
+            ("queue", "queue__id__in"),
+            ("assigned_to", "assigned_to__id__in"),
+            ("status", "status__in"),
+            ("kbitem", "kbitem__in"),
+        ]
+        filter_null_params = dict(
+            [
+                ("queue", "queue__id__isnull"),
+                ("assigned_to", "assigned_to__id__isnull"),
+                ("status", "status__isnull"),
+                ("kbitem", "kbitem__isnull"),
+            ]
         )
-    except PageNotAnInteger:
-        all_tickets_reported_by_current_user = paginator.page(1)
-    except EmptyPage:
-        all_tickets_reported_by_current_user = paginator.page(paginator.num_pages)
+        for param, filter_command in filter_in_params:
+            if request.GET.get(param) is not None:
+                patterns = request.GET.getlist(param)
+                if not patterns:
+                    continue
+                try:
+                    minus_1_ndx = patterns.index("-1")
+                    # Must have the value so remove it and configure to use OR filter on NULL
+                    patterns.pop(minus_1_ndx)
+                    query_params["filtering_null"][filter_null_params[param]] = True
+                except ValueError:
+                    pass
+                if not patterns:
+                    # Caters for the case where the filter is only a null filter
+                    continue
+                try:
+                    pattern_pks = [int(pattern) for pattern in patterns]
+                    query_params["filtering"][filter_command] = pattern_pks
+                except ValueError:
+                    pass
 
-    paginator = Paginator(recent_activity_tickets, tickets_per_page)
-    try:
-        recent_activity_tickets = paginator.page(recent_activity_page)
-    except PageNotAnInteger:
-        recent_activity_tickets = paginator.page(1)
-    except EmptyPage:
-        recent_activity_tickets = paginator.page(paginator.num_pages)
+        date_from = request.GET.get("date_from")
+        if date_from:
+            query_params["filtering"]["created__gte"] = date_from
+
+        date_to = request.GET.get("date_to")
+        if date_to:
+            query_params["filtering"]["created__lte"] = date_to
+
+        # KEYWORD SEARCHING
+        q = request.GET.get("q", "")
+        context["query"] = q
+        query_params["search_string"] = q
+
+        # SORTING
+        sort = request.GET.get("sort", None)
+        if sort not in (
+            "status",
+            "assigned_to",
+            "created",
+            "title",
+            "queue",
+            "priority",
+            "last_followup",
+            "kbitem",
+        ):
+            sort = "created"
+        query_params["sorting"] = sort
+
+        sortreverse = request.GET.get("sortreverse", None)
+        query_params["sortreverse"] = sortreverse
 
+    urlsafe_query = query_to_base64(query_params)
+
+    user_saved_queries = SavedSearch.objects.filter(
+        Q(user=request.user) | Q(shared__exact=True)
+    )
+
+    search_message = ""
+    if query_params["search_string"] and settings.DATABASES["default"][
+        "ENGINE"
+    ].endswith("sqlite"):
+        search_message = _(
+            "<p><strong>Note:</strong> Your keyword search is case sensitive "
+            "because of your database. This means the search will <strong>not</strong> "
+            "be accurate. By switching to a different database system you will gain "
+            "better searching! For more information, read the "
+            '<a href="http://docs.djangoproject.com/en/dev/ref/databases/#sqlite-string-matching">'
+            "Django Documentation on string matching in SQLite</a>."
+        )
 
     return render(
         request,
-        "helpdesk/dashboard.html",
-        {
-            "user_tickets": tickets,
-            "user_tickets_closed_resolved": tickets_closed_resolved,
-            "unassigned_tickets": unassigned_tickets,
-            "kbitems": kbitems,
-            "all_tickets_reported_by_current_user": all_tickets_reported_by_current_user,
-            "basic_ticket_stats": basic_ticket_stats,
-            "recent_activity_tickets": recent_activity_tickets,
-        },
+        "helpdesk/ticket_list.html",
+        dict(
+            context,
+            default_tickets_per_page=request.user.usersettings_helpdesk.tickets_per_page,
+            queue_choices=huser.get_queues(),
+            status_choices=Ticket.STATUS_CHOICES,
+            urlsafe_query=urlsafe_query,
+            user_saved_queries=user_saved_queries,
+            query_params=query_params,
+            from_saved_query=saved_query is not None,
+            saved_query=saved_query,
+            search_message=search_message,
+            helpdesk_settings=helpdesk_settings,
+        ),
     )
 
 
-dashboard = staff_member_required(dashboard)
+ticket_list = staff_member_required(ticket_list)
+
+
+@helpdesk_staff_member_required
+def view_ticket(request, ticket_id):
+    """
+    helpdesk's view_ticket, with the ticket's related objects loaded by
+    ilifu.ticket_context in a fixed number of queries. Archived tickets are
+    shown read only.
+    """
+    try:
+        ticket = get_ticket_queryset().get(id=ticket_id)
+    except Ticket.DoesNotExist:
+        return view_archived_ticket(request, ticket_id)
+    ticket_perm_check(request, ticket)
+
+    if "take" in request.GET:
+        update_ticket(request.user, ticket, owner=request.user.id)
+        return return_to_ticket(request.user, ticket)
+
+    if "subscribe" in request.GET:
+        # Allow the user to subscribe him/herself to the ticket whilst viewing
+        # it.
+        show_subscribe = return_ticketccstring_and_show_subscribe(request.user, ticket)[1]
+
+        if show_subscribe:
+            subscribe_to_ticket_updates(ticket, request.user.id)
+            return HttpResponseRedirect(reverse("helpdesk:view", args=[ticket.id]))
+
+    if "close" in request.GET and ticket.status == Ticket.RESOLVED_STATUS:
+        owner = ticket.assigned_to.id if ticket.assigned_to else 0
+        update_ticket(
+            request.user,
+            ticket,
+            owner=owner,
+            comment=_("Accepted resolution and closed ticket"),
+        )
+        return return_to_ticket(request.user, ticket)
+
+    checklist_form = CreateChecklistForm(request.POST or None)
+    if checklist_form.is_valid():
+        checklist = checklist_form.save(commit=False)
+        checklist.ticket = ticket
+        checklist.save()
+
+        checklist_template = checklist_form.cleaned_data.get("checklist_template")
+        # Add predefined tasks if template has been selected
+        if checklist_template:
+            checklist.create_tasks_from_template(checklist_template)
+
+        return redirect("helpdesk:edit_ticket_checklist", ticket.id, checklist.id)
+
+    extra_context_kwargs = get_form_extra_kwargs(request.user)
+    form = TicketForm(
+        initial={"due_date": ticket.due_date},
+        queue_choices=extra_context_kwargs["queues"],
+    )
+
+    return render(request, "helpdesk/ticket.html", {
+        **get_ticket_context(request.user, ticket),
+        "form": form,
+        "preset_replies": PreSetReply.objects.filter(
+            Q(queues=ticket.queue) | Q(queues__isnull=True)
+        ),
+        "checklist_form": checklist_form,
+        # add custom fields to further details panel
+        "customfields_form": EditTicketCustomFieldForm(None, instance=ticket),
+        **extra_context_kwargs,
+    })
+
+
+view_ticket = staff_member_required(view_ticket)
+
+
+def view_archived_ticket(request, ticket_id):
+    """An archived ticket (see ilifu.archive) at the URL it had, read only."""
+    archived = get_object_or_404(ArchivedTicket, id=ticket_id)
+    ticket, followups = load_archived_ticket(archived)
+    ticket_perm_check(request, ticket)
+    return render(request, "helpdesk/archived_ticket.html", {
+        "archived": archived,
+        "ticket": ticket,
+        "followups": followups,
+    })
+
+
+@etag(lambda request, digest: digest)
+def inline_image(request, digest):
+    """
+    An image extracted from an HTML email body (see ilifu.email_html). The
+    URL is derived from the content, so the response never changes and may
+    be cached for good. Like the attachments under MEDIA_URL it needs no
+    login; the digest is not guessable.
+    """
+    image = get_object_or_404(InlineImage, digest=digest)
+    response = FileResponse(image.file.open('rb'), content_type=image.mime_type)
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
@@ -55,10 +55,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ilifu.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ilifu.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # 'mozilla_django_oidc.middleware.SessionRefresh',
@@ -85,6 +87,43 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ilifu_helpdesk.wsgi.application'
 
+# Serve the dashboard from ilifu.views.dashboard_async, which queries its
+# sections concurrently and loads the slow ones as separate fragments. Only
+# worthwhile when running under ASGI (ilifu_helpdesk.asgi.application).
+ILIFU_ASYNC_DASHBOARD = False
+
+# Mass updates from the ticket list are applied this many tickets per
+# transaction; selections of at least ILIFU_MASS_UPDATE_BACKGROUND_THRESHOLD
+# tickets run as a background job (see ilifu.mass_update).
+ILIFU_MASS_UPDATE_CHUNK_SIZE = 500
+ILIFU_MASS_UPDATE_BACKGROUND_THRESHOLD = 200
+# A running job that has not recorded progress for this long is assumed to
+# have lost its thread, e.g. to a restart, and run_mass_update_jobs resumes it.
+ILIFU_MASS_UPDATE_STALE_SECONDS = 15 * 60
+
+# A cache shared by all workers on the host, so that invalidating the cached
+# user and KB item <option> lists (see ilifu.options) reaches every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/ilifu_helpdesk_cache',
+    }
+}
+ILIFU_OPTIONS_CACHE_TIMEOUT = 60 * 60
+# Replace the owner <select> on the ticket page with a search box backed by
+# the users/search/ endpoint instead of listing every possible owner.
+ILIFU_USER_TYPEAHEAD = False
+
+# <style> blocks and style attributes larger than this are dropped from the
+# HTML bodies of incoming emails (see ilifu.email_html).
+ILIFU_EMAIL_MAX_STYLE_SIZE = 16 * 1024
+
+# The archive_tickets command moves tickets closed or resolved and unchanged
+# for this many days out of the helpdesk tables, this many per transaction
+# (see ilifu.archive).
+ILIFU_ARCHIVE_AFTER_DAYS = 2 * 365
+ILIFU_ARCHIVE_CHUNK_SIZE = 200
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -103,12 +142,36 @@ DATABASES = {
         'PASSWORD': 'abcde12345',
         'HOST': 'localhost',
         'PORT': '5432',
-        'CONN_MAX_AGE': 60,
-        'CONN_HEALTH_CHECKS': True,
+        # Pooled connections (psycopg 3) instead of one persistent connection
+        # per worker; pooling requires CONN_MAX_AGE to be 0.
+        'CONN_MAX_AGE': 0,
         'DISABLE_SERVER_SIDE_CURSORS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': 2,
+                'max_size': 10,
+                'timeout': 10,
+            },
+        },
     }
 }
 
+# Optional read replica for the read-heavy views (see ilifu.routers). Any
+# alias named by ILIFU_REPLICA_DATABASE enables routing; without it every
+# query goes to 'default'. Locally a second database (or an SQLite file) can
+# stand in for the replica; in tests mirror 'default' so they share data.
+# DATABASES['replica'] = {
+#     **DATABASES['default'],
+#     'HOST': 'replica.localhost',
+#     'TEST': {'MIRROR': 'default'},
+# }
+
+DATABASE_ROUTERS = ['ilifu.routers.ReplicaRouter']
+ILIFU_REPLICA_DATABASE = 'replica'
+# Seconds a browser keeps reading from the primary after it submitted a form,
+# so people see their own changes while the replica catches up.
+ILIFU_REPLICA_STICKY_SECONDS = 15
+
 # ALLOWED_HOSTS = ['127.0.0.1']
 
 AUTHENTICATION_BACKENDS = (
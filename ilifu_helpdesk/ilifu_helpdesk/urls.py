@@ -21,14 +21,40 @@ from django.contrib import admin
 from django.urls import path
 
 from .views import login, logout
-from ilifu.views import dashboard
+from ilifu.views import (
+    dashboard,
+    dashboard_async,
+    dashboard_recent_activity,
+    dashboard_stats,
+    inline_image,
+    mass_update,
+    mass_update_progress,
+    ticket_list,
+    user_search,
+    view_ticket,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('oidc/', include('mozilla_django_oidc.urls')),
     path('login/', login, name='login'),
     path('logout/', logout, name='logout'),
-    path('dashboard/', dashboard, name='dashboard'),
+    path(
+        'dashboard/',
+        dashboard_async if getattr(settings, 'ILIFU_ASYNC_DASHBOARD', False) else dashboard,
+        name='dashboard',
+    ),
+    path('dashboard/stats/', dashboard_stats, name='dashboard_stats'),
+    path('dashboard/recent-activity/', dashboard_recent_activity, name='dashboard_recent_activity'),
+    # same path as helpdesk:list, so the ticket list uses the cached KB items
+    path('tickets/', ticket_list, name='ticket_list'),
+    # same path as helpdesk:mass_update, so the ticket list's form posts here
+    path('tickets/update/', mass_update),
+    path('tickets/update/<int:job_id>/', mass_update_progress, name='mass_update_progress'),
+    path('users/search/', user_search, name='user_search'),
+    path('inline-images/<slug:digest>/', inline_image, name='inline_image'),
+    # same path as helpdesk:view, so ticket links reach the prefetching view
+    path('tickets/<int:ticket_id>/', view_ticket),
     path('', include('helpdesk.urls', namespace='helpdesk')),
 ]
 